@@ -0,0 +1,150 @@
+# coding: utf-8
+
+# =====================================
+# Single-pass auditing of the OSM file
+# =====================================
+#
+# Each audit (tag counts, street types, state names, zipcodes, ...) is an
+# auditor object visiting the elements of one shared streaming parse, so the
+# OSM file is read only once no matter how many audits are run.
+
+from collections import OrderedDict, defaultdict
+
+from osm_stream import element_stream
+from street_types import street_type as find_street_type
+
+# List of expected street types
+expected = ["Street", "Avenue", "Boulevard", "Drive", "Court", "Place", "Square", "Lane", "Road",
+            "Trail", "Parkway", "Commons", 'Circle','Highway','Center','Turnpike','Way']
+
+# This function creates a list of all unexpected street types
+# which are not in the expected list (the type being the last word before
+# any unit number or direction, e.g. "Ave" of "Massachusetts Ave #3")
+def audit_street_type(street_types, street_name):
+    street_type = find_street_type(street_name)
+    if street_type is not None and street_type not in expected:
+        street_types[street_type].add(street_name)
+
+# This function checks if the address type is a street type
+def is_street_name(elem):
+    return (elem.attrib['k'] == "addr:street")
+
+# This function creates a list of all types of states
+def audit_state_type(state_types, state_name):
+    if state_name not in state_types:
+        state_types[state_name] = 1
+    else:
+        state_types[state_name] += 1
+
+# This function checks if the address type is a state type
+def is_state_name(elem):
+    return (elem.attrib['k'] == "addr:state")
+
+# This function creates a list of all types of zipcode
+def audit_zipcode(zipcode_types, zipcode):
+    if zipcode not in zipcode_types:
+        zipcode_types[zipcode] = 1
+    else:
+        zipcode_types[zipcode] += 1
+
+# This function checks if the address type is a zipcode type
+def is_zipcode(elem):
+    return (elem.attrib['k'] == "addr:postcode")
+
+
+class Auditor(object):
+    """Visitor collecting one audit report during the shared pass.
+
+    `tags` restricts which top-level elements are visited (None visits all
+    of them, including e.g. <bounds>).
+    """
+
+    tags = ('node', 'way')
+
+    def __init__(self):
+        self.report = self.new_report()
+
+    def new_report(self):
+        return {}
+
+    def visit(self, element):
+        """Called once for every complete top-level element"""
+        raise NotImplementedError
+
+    def finish(self, root):
+        """Called once after the whole file has been read"""
+        pass
+
+
+class TagCounter(Auditor):
+    """Counts the number of every tag in the file (see count_tags)"""
+
+    tags = None
+
+    def visit(self, element):
+        for elem in element.iter():
+            self.report[elem.tag] = self.report.get(elem.tag, 0) + 1
+
+    def finish(self, root):
+        self.report[root.tag] = self.report.get(root.tag, 0) + 1
+
+
+class TagValueAuditor(Auditor):
+    """Feeds the value of every <tag> accepted by `is_match` to `audit_func`"""
+
+    def __init__(self, is_match, audit_func, report_factory=dict):
+        self.is_match = is_match
+        self.audit_func = audit_func
+        self.report_factory = report_factory
+        super(TagValueAuditor, self).__init__()
+
+    def new_report(self):
+        return self.report_factory()
+
+    def visit(self, element):
+        for tag in element.iter("tag"):
+            if self.is_match(tag):
+                self.audit_func(self.report, tag.attrib['v'])
+
+
+# Registry of the available auditors, by name. Each value is a callable
+# returning a fresh Auditor, so every audit() call starts from empty reports.
+AUDITORS = OrderedDict()
+
+def register_auditor(name, factory):
+    """Make an auditor available to audit() under the given name"""
+    AUDITORS[name] = factory
+    return factory
+
+register_auditor('tags', TagCounter)
+register_auditor('street', lambda: TagValueAuditor(is_street_name, audit_street_type,
+                                                   lambda: defaultdict(set)))
+register_auditor('state', lambda: TagValueAuditor(is_state_name, audit_state_type))
+register_auditor('zipcode', lambda: TagValueAuditor(is_zipcode, audit_zipcode))
+
+
+def audit(osmfile, names=None, auditors=None):
+    """Run the named (default: all registered) auditors plus any extra
+    Auditor instances over a single pass of the file.
+
+    Returns a dict of reports keyed by auditor name; extra auditors are
+    keyed by their position in `auditors` unless given as a dict.
+    """
+    if names is None:
+        names = AUDITORS.keys()
+    active = OrderedDict((name, AUDITORS[name]()) for name in names)
+    if isinstance(auditors, dict):
+        active.update(auditors)
+    elif auditors:
+        active.update(enumerate(auditors))
+
+    with open(osmfile, "r") as osm_file:
+        stream = element_stream(osm_file, tags=None)
+        for elem in stream:
+            for auditor in active.values():
+                if auditor.tags is None or elem.tag in auditor.tags:
+                    auditor.visit(elem)
+        for auditor in active.values():
+            auditor.finish(stream.root)
+
+    return OrderedDict((name, auditor.report) for name, auditor in active.items())
@@ -0,0 +1,73 @@
+# coding: utf-8
+
+# =====================================
+# Peak memory of the streaming parse vs input size
+# =====================================
+#
+# Generates synthetic OSM files of growing size, runs the full audit() pass
+# over each one in a fresh process and reports the peak RSS. The streaming
+# parser keeps memory flat, so the largest file must not use much more than
+# the smallest one; the script exits with status 1 otherwise.
+#
+#   python benchmarks/bench_memory.py [max_nodes]
+
+import os
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+# Allowed growth of peak RSS between the smallest and the largest file
+MAX_GROWTH_MB = 10.0
+
+
+# Run in the child process: VmHWM is reset by exec, whereas on Linux
+# ru_maxrss carries over the peak of the forked parent (the file generator).
+MEASURE = """
+import resource, audit
+audit.audit({0!r})
+try:
+    with open('/proc/self/status') as f:
+        print([l.split()[1] for l in f if l.startswith('VmHWM:')][0])
+except IOError:
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def peak_rss_mb(osm_path):
+    """Peak RSS (MB) of a child process auditing osm_path"""
+    out = subprocess.check_output([sys.executable, '-c', MEASURE.format(osm_path)],
+                                  cwd=os.path.dirname(HERE))
+    return int(out.strip()) / 1024.0
+
+
+def main(max_nodes=1000000):
+    from synthetic_osm import write_osm
+
+    sizes = []
+    n = max_nodes
+    while n >= 10000:
+        sizes.insert(0, n)
+        n //= 10
+    tmpdir = tempfile.mkdtemp()
+    results = []
+    for n_nodes in sizes:
+        path = os.path.join(tmpdir, 'synthetic_{0}.osm'.format(n_nodes))
+        write_osm(path, n_nodes)
+        file_mb = os.path.getsize(path) / (1024 * 1024.0)
+        rss = peak_rss_mb(path)
+        os.remove(path)
+        results.append((file_mb, rss))
+        print('{0:10.1f} MB input  {1:8.1f} MB peak RSS'.format(file_mb, rss))
+    os.rmdir(tmpdir)
+
+    growth = results[-1][1] - results[0][1]
+    print('peak RSS growth: {0:.1f} MB (limit {1:.1f} MB)'.format(growth, MAX_GROWTH_MB))
+    return 0 if growth <= MAX_GROWTH_MB else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(a) for a in sys.argv[1:]]))
@@ -0,0 +1,109 @@
+# coding: utf-8
+
+# =====================================
+# Dict vs tuple shaping of elements
+# =====================================
+#
+# Compares the time and the memory allocated for the shaped output of the
+# former dict-per-row shape_element (copied below) with shape_record, which
+# emits tuple rows in column order, then the time of shaping and validating
+# (validate_element of the dicts, validate_record of the tuple rows).
+#
+#   python benchmarks/bench_shaping.py [osm_file]
+
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from cleaning import CLEANERS
+from osm_stream import get_element
+from fast_validator import FastValidator
+from process_osm import (classify_key, shape_record, validate_element, validate_record,
+                         NODE_FIELDS, WAY_FIELDS)
+
+
+def shape_element_dicts(element):
+    """shape_element as it was before the tuple records: one dict per row"""
+    tags = []
+    attribs = {}
+    fields = NODE_FIELDS if element.tag == 'node' else WAY_FIELDS
+    for field in fields:
+        attribs[field] = element.attrib[field]
+    for tag in element.iter("tag"):
+        k = tag.attrib['k']
+        key_split = classify_key(k)
+        if key_split is None:
+            continue
+        d = {}
+        d['id'] = attribs['id']
+        d['type'], d['key'] = key_split
+        cleaner = CLEANERS.get(k)
+        d['value'] = cleaner(tag.attrib['v']) if cleaner is not None else tag.attrib['v']
+        tags.append(d)
+    if element.tag == 'node':
+        return {'node': attribs, 'node_tags': tags}
+    way_nodes = []
+    index = 0
+    for tag in element.iter("nd"):
+        d = {}
+        d['id'] = attribs['id']
+        d['node_id'] = tag.attrib['ref']
+        d['position'] = index
+        way_nodes.append(d)
+        index += 1
+    return {'way': attribs, 'way_nodes': way_nodes, 'way_tags': tags}
+
+
+def container_bytes(obj):
+    """Bytes of the containers (dicts, lists, tuples, records) of a shaped
+    element; the attribute strings themselves are shared by both variants"""
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(container_bytes(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sys.getsizeof(obj) + sum(container_bytes(v) for v in obj)
+    if hasattr(obj, '__slots__'):
+        return sys.getsizeof(obj) + sum(container_bytes(getattr(obj, name))
+                                        for name in obj.__slots__)
+    return 0
+
+
+def main(osm_file=None):
+    synthetic = None
+    if osm_file is None:
+        from synthetic_osm import write_osm
+        synthetic = osm_file = os.path.join(tempfile.mkdtemp(), 'synthetic.osm')
+        write_osm(osm_file, 50000)
+
+    import xml.etree.cElementTree as ET
+    # keep the parsed elements so that only the shaping is timed
+    elements = [ET.fromstring(ET.tostring(e)) for e in get_element(osm_file, ('node', 'way'))]
+    if synthetic:
+        os.remove(synthetic)
+        os.rmdir(os.path.dirname(synthetic))
+
+    for name, shape in (('dicts', shape_element_dicts), ('records', shape_record)):
+        start = time.time()
+        shaped = [shape(e) for e in elements]
+        seconds = time.time() - start
+        size = sum(container_bytes(s) for s in shaped)
+        print('{0:8s} {1:8.2f} us/element  {2:8.0f} container bytes/element'.format(
+            name, seconds / len(elements) * 1e6, float(size) / len(elements)))
+
+    for name, shape, validate in (('dicts', shape_element_dicts, validate_element),
+                                  ('records', shape_record, validate_record)):
+        validator = FastValidator()
+        start = time.time()
+        for e in elements:
+            validate(shape(e), validator)
+        seconds = time.time() - start
+        print('{0:8s} {1:8.2f} us/element shaped and validated'.format(
+            name, seconds / len(elements) * 1e6))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
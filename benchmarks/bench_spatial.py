@@ -0,0 +1,96 @@
+# coding: utf-8
+
+# =====================================
+# R*Tree vs full scan for area queries
+# =====================================
+#
+# Times random bounding box and radius queries (with and without a tag
+# filter) over the nodes of a database, through the R*Tree of spatial.py and
+# by scanning the nodes table, and checks that both return the same nodes.
+# Runs on a copy of the Boston sample database by default, or on a database
+# loaded from a synthetic OSM file of n_nodes nodes.
+#
+#   python benchmarks/bench_spatial.py [db_path | n_nodes]
+
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from spatial import bbox_query, create_spatial_index, radius_query
+
+SAMPLE_DB = os.path.join(os.path.dirname(HERE), "boston_massachusetts_sample.db")
+
+N_QUERIES = 200
+
+
+def prepare_db(arg, tmp_dir):
+    db_path = os.path.join(tmp_dir, 'bench.db')
+    if arg is None and os.path.exists(SAMPLE_DB):
+        shutil.copy(SAMPLE_DB, db_path)
+    elif arg is not None and not arg.isdigit():
+        shutil.copy(arg, db_path)
+    else:
+        from load_db import load_osm
+        from synthetic_osm import write_osm
+        osm_path = os.path.join(tmp_dir, 'synthetic.osm')
+        write_osm(osm_path, int(arg or 200000))
+        load_osm(osm_path, db_path)
+    con = sqlite3.connect(db_path)
+    con.text_factory = str
+    for statement in ('CREATE INDEX IF NOT EXISTS nodes_tags_key_value_id '
+                      'ON nodes_tags(key, value, id);',
+                      'CREATE INDEX IF NOT EXISTS nodes_tags_id ON nodes_tags(id);'):
+        con.execute(statement)
+    start = time.time()
+    create_spatial_index(con)
+    print('R*Tree built in {0:.2f} s'.format(time.time() - start))
+    return con
+
+
+def time_queries(run, queries):
+    start = time.time()
+    results = [run(*q) for q in queries]
+    return (time.time() - start) / len(queries) * 1000, results
+
+
+def main(arg=None):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        con = prepare_db(arg, tmp_dir)
+        min_lat, max_lat, min_lon, max_lon = con.execute(
+            'SELECT MIN(lat), MAX(lat), MIN(lon), MAX(lon) FROM nodes;').fetchone()
+        print('{0} nodes'.format(con.execute('SELECT COUNT(*) FROM nodes;').fetchone()[0]))
+        rnd = random.Random(0)
+        points = [(rnd.uniform(min_lat, max_lat), rnd.uniform(min_lon, max_lon))
+                  for _ in range(N_QUERIES)]
+        # boxes of about 1 x 1 km and circles of 500 m
+        boxes = [(lat - 0.0045, lon - 0.006, lat + 0.0045, lon + 0.006) for lat, lon in points]
+        circles = [(lat, lon, 500) for lat, lon in points]
+
+        for tags in (None, {'amenity': 'restaurant'}):
+            for name, queries, query in (('bbox', boxes, bbox_query),
+                                         ('radius', circles, radius_query)):
+                results = {}
+                for use_index in (False, True):
+                    ms, results[use_index] = time_queries(
+                        lambda *q: query(con, *(q + (tags, use_index))), queries)
+                    print('{0:6s} {1:22s} {2:5s} {3:8.3f} ms/query'.format(
+                        name, tags and 'amenity=restaurant' or 'all nodes',
+                        use_index and 'rtree' or 'scan', ms))
+                same = all(sorted(a) == sorted(b) for a, b in zip(results[False], results[True]))
+                print('       same results: {0}'.format(same))
+        con.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
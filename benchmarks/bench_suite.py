@@ -0,0 +1,170 @@
+# coding: utf-8
+
+# =====================================
+# Benchmark suite of the whole pipeline
+# =====================================
+#
+# For each size, generates (once, kept in --data-dir) a realistic synthetic
+# OSM file with write_realistic_osm and times, in a scratch directory:
+#
+#   count_tags, every auditor of audit.py alone and all of them in one pass,
+#   process_map without and with validation, the CSV to SQLite load
+#   (load_db.load_csv) and every analysis query of queries.py
+#
+# The results can be saved as a named baseline in benchmarks/baselines/ and
+# compared with one, reporting the ratio of each timing:
+#
+#   python benchmarks/bench_suite.py --sizes 10MB,100MB --save laptop
+#   python benchmarks/bench_suite.py --sizes 10MB,100MB,1GB --compare laptop
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from audit import AUDITORS, audit
+from load_db import load_csv
+from process_osm import process_map
+from queries import QUERIES, time_query
+from synthetic_osm import write_realistic_osm
+
+BASELINE_DIR = os.path.join(HERE, 'baselines')
+DATA_DIR = os.path.join(tempfile.gettempdir(), 'osm_bench_data')
+
+UNITS = {'KB': 1 << 10, 'MB': 1 << 20, 'GB': 1 << 30}
+
+# Ratio to the baseline above which a timing is reported as a regression
+REGRESSION_RATIO = 1.2
+
+
+def parse_size(size):
+    size = size.strip().upper()
+    return int(float(size[:-2]) * UNITS[size[-2:]])
+
+
+def timed(func, *args):
+    start = time.time()
+    func(*args)
+    return round(time.time() - start, 4)
+
+
+def data_file(size, seed, data_dir):
+    """Path of the synthetic file of a size, generated if missing"""
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+    path = os.path.join(data_dir, 'realistic_{0}_{1}.osm'.format(size, seed))
+    if not os.path.exists(path):
+        print('generating {0}'.format(path))
+        write_realistic_osm(path + '.tmp', parse_size(size), seed)
+        os.rename(path + '.tmp', path)
+    return path
+
+
+def run_size(osm_path, work_dir, query_repeat=3):
+    """Timings (s) of every benchmark on one file"""
+    timings = OrderedDict()
+    timings['count_tags'] = timed(audit, osm_path, ['tags'])
+    for name in AUDITORS:
+        if name != 'tags':
+            timings['audit_' + name] = timed(audit, osm_path, [name])
+    timings['audit_all'] = timed(audit, osm_path)
+
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        timings['process_map'] = timed(process_map, osm_path, False)
+        timings['process_map_validate'] = timed(process_map, osm_path, True)
+        timings['load_csv'] = timed(load_csv, 'bench.db')
+        con = sqlite3.connect('bench.db')
+        con.text_factory = str
+        for name in QUERIES:
+            timings['query_' + name] = round(time_query(con, name, query_repeat), 4)
+        con.close()
+    finally:
+        os.chdir(cwd)
+    return timings
+
+
+def compare(results, baseline):
+    """Print the ratio of every timing to the baseline; returns the number
+    of regressions"""
+    regressions = 0
+    for size, result in results['sizes'].items():
+        base = baseline['sizes'].get(size)
+        if base is None:
+            print('{0}: not in the baseline'.format(size))
+            continue
+        print('{0}:'.format(size))
+        for name, seconds in result['timings'].items():
+            before = base['timings'].get(name)
+            if not before:
+                continue
+            ratio = seconds / before
+            flag = ''
+            if ratio > REGRESSION_RATIO and seconds - before > 0.01:
+                flag = '  REGRESSION'
+                regressions += 1
+            print('  {0:28s} {1:9.4f} s  {2:9.4f} s  x{3:5.2f}{4}'.format(
+                name, before, seconds, ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark suite of the OSM pipeline')
+    parser.add_argument('--sizes', default='10MB,100MB',
+                        help='comma separated file sizes (e.g. 10MB,100MB,1GB)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=DATA_DIR,
+                        help='where the generated files are kept between runs')
+    parser.add_argument('--save', metavar='NAME', help='save the results as a baseline')
+    parser.add_argument('--compare', metavar='NAME', help='compare with a saved baseline')
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    results = OrderedDict([
+        ('created', time.strftime('%Y-%m-%dT%H:%M:%S')),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('seed', args.seed),
+        ('sizes', OrderedDict()),
+    ])
+    for size in args.sizes.split(','):
+        osm_path = data_file(size.strip(), args.seed, args.data_dir)
+        work_dir = tempfile.mkdtemp()
+        try:
+            timings = run_size(osm_path, work_dir)
+        finally:
+            shutil.rmtree(work_dir)
+        results['sizes'][size.strip()] = OrderedDict([
+            ('file_bytes', os.path.getsize(osm_path)), ('timings', timings)])
+        print('{0}:'.format(size))
+        for name, seconds in timings.items():
+            print('  {0:28s} {1:9.4f} s'.format(name, seconds))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.save:
+        if not os.path.isdir(BASELINE_DIR):
+            os.makedirs(BASELINE_DIR)
+        with open(os.path.join(BASELINE_DIR, args.save + '.json'), 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, args.compare + '.json')) as f:
+            baseline = json.load(f)
+        return 1 if compare(results, baseline) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,65 @@
+# coding: utf-8
+
+# =====================================
+# cerberus vs compiled validation of shaped elements
+# =====================================
+#
+# Shapes every node and way of an OSM file (the Boston sample by default, a
+# synthetic file if it is not available) and times validate_element with
+# cerberus.Validator and with FastValidator on the dict documents, and
+# validate_record, which checks the tuple rows of the shaped records.
+#
+#   python benchmarks/bench_validation.py [osm_file]
+
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import cerberus
+
+from fast_validator import FastValidator
+from osm_stream import get_element
+from process_osm import shape_record, validate_element, validate_record
+
+SAMPLE_FILE = os.path.join(os.path.dirname(HERE), "boston_massachusetts_sample.osm")
+
+
+def time_validator(elements, validator, validate=validate_element):
+    start = time.time()
+    for el in elements:
+        validate(el, validator)
+    return time.time() - start
+
+
+def main(osm_file=None):
+    synthetic = None
+    if osm_file is None and os.path.exists(SAMPLE_FILE):
+        osm_file = SAMPLE_FILE
+    if osm_file is None:
+        from synthetic_osm import write_osm
+        synthetic = osm_file = os.path.join(tempfile.mkdtemp(), 'synthetic.osm')
+        write_osm(osm_file, 20000)
+
+    records = [shape_record(e) for e in get_element(osm_file, tags=('node', 'way'))]
+    elements = [record.as_dict() for record in records]
+    if synthetic:
+        os.remove(synthetic)
+        os.rmdir(os.path.dirname(synthetic))
+    print('{0} elements from {1}'.format(len(elements), osm_file))
+
+    slow = time_validator(elements, cerberus.Validator())
+    fast = time_validator(elements, FastValidator())
+    rows = time_validator(records, FastValidator(), validate_record)
+    for name, seconds in (('cerberus', slow), ('compiled', fast), ('rows', rows)):
+        print('{0:10s} {1:8.3f} s  {2:10.0f} elements/s'.format(
+            name, seconds, len(elements) / seconds))
+    print('speedup: {0:.1f}x (compiled), {1:.1f}x (rows)'.format(slow / fast, slow / rows))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,244 @@
+# coding: utf-8
+
+# =====================================
+# Synthetic OSM XML files for benchmarks
+# =====================================
+#
+# write_osm writes simple files of n nodes (used by the memory, shaping,
+# validation and spatial benchmarks); write_realistic_osm writes files of a
+# given size with realistic tags (used by bench_suite.py).
+
+import bisect
+import random
+
+from audit import expected
+from cleaning import mapping_state, mapping_street
+
+HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+          '<osm version="0.6" generator="synthetic_osm">\n'
+          ' <bounds minlat="42.2279" minlon="-71.1912" maxlat="42.3995" maxlon="-70.9860"/>\n')
+FOOTER = '</osm>\n'
+
+NODE = (' <node id="{0}" lat="{1:.7f}" lon="{2:.7f}" user="user{3}" uid="{3}" version="1"'
+        ' changeset="{4}" timestamp="2016-01-01T00:00:00Z"')
+WAY = (' <way id="{0}" user="user{1}" uid="{1}" version="1" changeset="{2}"'
+       ' timestamp="2016-01-01T00:00:00Z">\n')
+TAG = '  <tag k="{0}" v="{1}"/>\n'
+ND = '  <nd ref="{0}"/>\n'
+
+TAGS = [('addr:street', 'Main St'), ('addr:state', 'ma'), ('addr:postcode', '02134'),
+        ('amenity', 'restaurant'), ('cuisine', 'pizza'), ('building', 'yes')]
+
+
+def write_osm(path, n_nodes, seed=0):
+    """Write an OSM file with n_nodes nodes and one way per 10 nodes"""
+    rnd = random.Random(seed)
+    with open(path, 'w') as f:
+        f.write(HEADER)
+        for i in range(1, n_nodes + 1):
+            f.write(NODE.format(i, 42.23 + rnd.random() * 0.17, -71.19 + rnd.random() * 0.2,
+                                i % 500, i // 100))
+            if i % 4:
+                f.write('/>\n')
+            else:
+                f.write('>\n')
+                for k, v in rnd.sample(TAGS, 2):
+                    f.write(TAG.format(k, v))
+                f.write(' </node>\n')
+        for i in range(1, n_nodes // 10 + 1):
+            f.write(WAY.format(n_nodes + i, i % 500, i))
+            for ref in range(i * 10 - 9, i * 10 + 1):
+                f.write(ND.format(ref))
+            f.write(TAG.format('building', 'yes'))
+            f.write(' </way>\n')
+        f.write(FOOTER)
+
+
+# =====================================
+# Realistic files of a given size
+# =====================================
+#
+# write_realistic_osm writes files closer to the Boston extract: most nodes
+# are untagged way vertices, the tagged ones carry amenities (with cuisine or
+# religion), shops or address blocks; ways are streets (long) and buildings
+# (closed rings of 4 to 12 nodes); contributions follow a Zipf-like
+# distribution over users. The address values have the noise cleaned by
+# cleaning.py: street types from the keys of mapping_street, states from the
+# keys of mapping_state and zipcodes with ZIP+4, state prefixes or outside
+# of the Boston range.
+
+STREET_NAMES = ['Main', 'Washington', 'Beacon', 'Tremont', 'Boylston', 'Commonwealth',
+                'Massachusetts', 'Cambridge', 'Harvard', 'Centre', 'Dorchester', 'Hancock',
+                'Elm', 'Park', 'Summer', 'Highland', 'School', u'Caf\xe9', 'Broadway', 'Prospect']
+CITIES = ['Boston', 'Cambridge', 'Somerville', 'Brookline', 'Quincy', 'Newton', 'Medford',
+          'boston', 'Boston, MA']
+AMENITIES = [('restaurant', 30), ('place_of_worship', 12), ('school', 10), ('cafe', 10),
+             ('bench', 9), ('parking', 8), ('bank', 6), ('fast_food', 6), ('library', 3),
+             ('post_office', 2), ('pharmacy', 2), ('bicycle_rental', 2)]
+CUISINES = [('pizza', 10), ('american', 8), ('chinese', 7), ('italian', 7), ('mexican', 5),
+            ('japanese', 4), ('indian', 4), ('thai', 3), ('sushi', 2), ('vietnamese', 2)]
+RELIGIONS = [('christian', 20), ('jewish', 3), ('muslim', 1), ('buddhist', 1)]
+SHOPS = ['supermarket', 'convenience', 'clothes', 'hairdresser', 'bakery', 'books']
+HIGHWAYS = [('residential', 40), ('service', 25), ('footway', 15), ('secondary', 8),
+            ('tertiary', 7), ('primary', 5)]
+BUILDINGS = [('yes', 60), ('house', 20), ('residential', 10), ('commercial', 5),
+             ('apartments', 5)]
+# Keys with a namespace (lower_colon) or with problematic characters
+EXTRA_TAGS = [('name:en', 'Boston'), ('tiger:county', 'Suffolk, MA'),
+              ('gnis:feature_id', '600000'), ('source', 'massgis'), ('fixme', 'check'),
+              ('bad key', 'x'), ('note.1', 'y')]
+
+# Share of the noisy variants among the address values
+NOISE = 0.25
+
+
+class Weighted(object):
+    """Draws values from (value, weight) pairs"""
+
+    def __init__(self, pairs):
+        self.values = [v for v, _ in pairs]
+        self.cumulative = []
+        total = 0
+        for _, weight in pairs:
+            total += weight
+            self.cumulative.append(total)
+        self.total = total
+
+    def draw(self, rnd):
+        return self.values[bisect.bisect_right(self.cumulative, rnd.random() * self.total)]
+
+
+def _street(rnd):
+    if rnd.random() < NOISE:
+        suffix = rnd.choice(sorted(mapping_street))
+    else:
+        suffix = rnd.choice(expected)
+    return u'{0} {1}'.format(rnd.choice(STREET_NAMES), suffix)
+
+
+def _state(rnd):
+    return rnd.choice(sorted(mapping_state)) if rnd.random() < NOISE else 'MA'
+
+
+def _postcode(rnd):
+    zipcode = '0{0}'.format(rnd.randint(1432, 2769))
+    if rnd.random() >= NOISE:
+        return zipcode
+    return rnd.choice(['{0}-{1:04d}'.format(zipcode, rnd.randint(0, 9999)),
+                       'MA {0}'.format(zipcode), zipcode[1:],
+                       '{0:05d}'.format(rnd.randint(3000, 99999))])
+
+
+def _address(rnd):
+    tags = [('addr:housenumber', str(rnd.randint(1, 999))), ('addr:street', _street(rnd))]
+    if rnd.random() < 0.6:
+        tags.append(('addr:city', rnd.choice(CITIES)))
+    if rnd.random() < 0.5:
+        tags.append(('addr:state', _state(rnd)))
+    if rnd.random() < 0.7:
+        tags.append(('addr:postcode', _postcode(rnd)))
+    return tags
+
+
+class RealisticGenerator(object):
+    """Tags, users and way lengths of write_realistic_osm"""
+
+    def __init__(self, seed=0, n_users=5000):
+        self.rnd = random.Random(seed)
+        # Zipf-like: user k contributes in proportion to 1/k
+        self.users = Weighted([(k, 1.0 / k) for k in range(1, n_users + 1)])
+        self.amenities = Weighted(AMENITIES)
+        self.cuisines = Weighted(CUISINES)
+        self.religions = Weighted(RELIGIONS)
+        self.highways = Weighted(HIGHWAYS)
+        self.buildings = Weighted(BUILDINGS)
+
+    def user(self):
+        return self.users.draw(self.rnd)
+
+    def node_tags(self):
+        rnd = self.rnd
+        r = rnd.random()
+        if r < 0.85:
+            return []
+        if r < 0.92:
+            amenity = self.amenities.draw(rnd)
+            tags = [('amenity', amenity), ('name', u'{0} {1}'.format(
+                rnd.choice(STREET_NAMES), amenity.replace('_', ' ').title()))]
+            if amenity == 'restaurant' and rnd.random() < 0.7:
+                tags.append(('cuisine', self.cuisines.draw(rnd)))
+            elif amenity == 'place_of_worship':
+                tags.append(('religion', self.religions.draw(rnd)))
+            if rnd.random() < 0.5:
+                tags.extend(_address(rnd))
+        elif r < 0.95:
+            tags = [('shop', rnd.choice(SHOPS))] + _address(rnd)
+        elif r < 0.99:
+            tags = _address(rnd)
+        else:
+            tags = [rnd.choice(EXTRA_TAGS)]
+        return tags
+
+    def way(self, n_nodes):
+        """(node refs, tags) of a street or a building"""
+        rnd = self.rnd
+        if rnd.random() < 0.6:
+            # building: closed ring
+            size = rnd.randint(4, 12)
+            start = rnd.randint(1, max(1, n_nodes - size))
+            refs = list(range(start, start + size - 1)) + [start]
+            tags = [('building', self.buildings.draw(rnd))]
+            if rnd.random() < 0.4:
+                tags.extend(_address(rnd))
+        else:
+            # street: 2 to ~200 nodes, mostly short
+            size = min(2 + int(rnd.expovariate(1 / 15.0)), 2000)
+            start = rnd.randint(1, max(1, n_nodes - size))
+            refs = list(range(start, start + size))
+            tags = [('highway', self.highways.draw(rnd)), ('name', _street(rnd))]
+            if rnd.random() < 0.05:
+                tags.append(rnd.choice(EXTRA_TAGS))
+        return refs, tags
+
+
+def _escape(value):
+    return (value.replace('&', '&amp;').replace('"', '&quot;')
+            .replace('<', '&lt;').replace('>', '&gt;').encode('utf-8'))
+
+
+def write_realistic_osm(path, target_bytes, seed=0):
+    """Write a realistic OSM file of about target_bytes bytes (about 70%
+    of them nodes); returns the number of nodes and ways"""
+    gen = RealisticGenerator(seed)
+    rnd = gen.rnd
+    written = 0
+    n_nodes = n_ways = 0
+    with open(path, 'wb') as f:
+        f.write(HEADER)
+        while written < target_bytes * 0.7:
+            n_nodes += 1
+            uid = gen.user()
+            chunk = [NODE.format(n_nodes, 42.23 + rnd.random() * 0.17,
+                                 -71.19 + rnd.random() * 0.2, uid, n_nodes // 100)]
+            tags = gen.node_tags()
+            if tags:
+                chunk.append('>\n')
+                chunk.extend(TAG.format(k, _escape(v)) for k, v in tags)
+                chunk.append(' </node>\n')
+            else:
+                chunk.append('/>\n')
+            data = ''.join(chunk)
+            f.write(data)
+            written += len(data)
+        while written < target_bytes:
+            n_ways += 1
+            refs, tags = gen.way(n_nodes)
+            chunk = [WAY.format(n_nodes + n_ways, gen.user(), n_ways // 10)]
+            chunk.extend(ND.format(ref) for ref in refs)
+            chunk.extend(TAG.format(k, _escape(v)) for k, v in tags)
+            chunk.append(' </way>\n')
+            data = ''.join(chunk)
+            f.write(data)
+            written += len(data)
+        f.write(FOOTER)
+    return n_nodes, n_ways
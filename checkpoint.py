@@ -0,0 +1,63 @@
+# coding: utf-8
+
+# =====================================
+# Checkpoints of long runs
+# =====================================
+#
+# process_map(..., checkpoint='boston.checkpoint') processes the OSM file as
+# a sequence of byte ranges aligned on element boundaries (osm_shards.py) and
+# saves a Checkpoint after each of them: the input offset reached and the
+# size and number of rows of every output file. Started again with the same
+# arguments after a crash or an interruption, it truncates the outputs to the
+# saved sizes and goes on from the saved offset, so the completed ranges are
+# not processed again and the outputs are the same as in an uninterrupted
+# run. The checkpoint file is removed once the run is complete; one saved for
+# another input file (or a modified one) or other settings is ignored.
+
+import json
+import os
+
+
+class Checkpoint(object):
+    """Progress of a run over one input file, saved as JSON"""
+
+    def __init__(self, path, input_path, settings=None):
+        self.path = path
+        st = os.stat(input_path)
+        self.identity = {'input': os.path.abspath(input_path), 'size': st.st_size,
+                         'mtime': st.st_mtime, 'settings': settings or {}}
+
+    def load(self):
+        """The saved state ({'offset': ..., 'outputs': {path: [size, rows]}})
+        if it belongs to the same input and settings, else None"""
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if state.get('identity') != self.identity:
+            return None
+        return state
+
+    def save(self, offset, outputs):
+        """Save the input offset reached and the (size, rows) of every output
+        path; the file is replaced atomically"""
+        state = {'identity': self.identity, 'offset': offset,
+                 'outputs': dict((path, list(counts)) for path, counts in outputs.items())}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, indent=2, sort_keys=True)
+        os.rename(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def reopen_output(path, size):
+    """Open an output file for appending after its first `size` bytes (the
+    rest, written after the last checkpoint, is dropped)"""
+    f = open(path, 'r+b')
+    f.truncate(size)
+    f.seek(size)
+    return f
@@ -0,0 +1,124 @@
+# coding: utf-8
+
+# =====================================
+# Cleaning of street names, states and zipcodes
+# =====================================
+
+from audit import expected
+from street_types import StreetTypeNormalizer
+from zipcodes import REGIONS, ZipcodeTable
+
+# Dictionary of unexpected street types as keys and their appropriate ones as values
+mapping_street = {"Ave": "Avenue","Ave.":"Avenue","Ct":"Court","Dr":"Drive","Ext":"Exit",
+           "HIghway":"Highway","Hwy":"Highway","Pkwy":"Parkway","Pl":"Place","Rd":"Road",
+           "ST":"Street","Sq.":"Square","St":"Street","St,":"Street","St.":"Street",
+           "Street.":"Street","rd.":"Road","st":"Street","street":"Street"}
+
+# This function update street names using the "mapping_street" dictionary
+def update_street(name, mapping):
+    name = name.split(" ")
+    if name[-1] in mapping:
+        name[-1] = mapping[name[-1]]
+    name = " ".join(name)
+    return name
+
+# Normalizer of the street type anywhere before a unit number or direction
+# ("Massachusetts Ave #3", "Main St, Suite 2"), without case or punctuation
+# mismatches, see street_types.py; this is the street cleaner of shape_element
+street_normalizer = StreetTypeNormalizer(expected, mapping_street)
+
+# Dictionary of unexpected state types as keys and their appropriate ones as values
+mapping_state = { "MA- MASSACHUSETTS": "MA",
+            "MASSACHUSETTS": "MA",
+            "Ma": "MA",
+            "Massachusetts": "MA",
+            "ma": "MA"
+            }
+
+# This function update state names using the "mapping_state" dictionary
+def update_state(name, mapping):
+    if name in mapping:
+        name = mapping[name]
+    return name
+
+# Valid zipcodes (ranges or prefixes, see zipcodes.py) of the Boston area
+zipcode_ranges = REGIONS['boston']
+zipcode_table = ZipcodeTable(zipcode_ranges)
+
+# This function update zipcode using its first five digits (also of a ZIP+4)
+# It returns "0" if the zipcode was not found or if it is outside of zipcode_ranges.
+def update_zipcode(zipcode):
+    return zipcode_table.clean(zipcode)
+
+
+# =====================================
+# Cached cleaners
+# =====================================
+#
+# Real data repeats the same few thousand street names, states and zipcodes
+# millions of times, so the cleaners used by shape_element remember their
+# recent results. The cache keeps two generations of at most maxsize/2
+# entries: a value is evicted once it has not been used for two generations,
+# which approximates LRU eviction with plain dict operations (an exact LRU
+# built on the pure Python OrderedDict of Python 2 is slower than the
+# uncached functions).
+#
+# The caches must be cleared (clear_caches, which also rebuilds the tables of
+# street_normalizer and zipcode_table) after changing the mappings or ranges.
+
+_MISSING = object()
+
+class CachedCleaner(object):
+    """Bounded cache in front of a cleaning function of one value"""
+
+    def __init__(self, func, maxsize=10000):
+        self.func = func
+        self.maxsize = maxsize
+        self.clear()
+
+    def clear(self):
+        self.recent = {}
+        self.older = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, value):
+        result = self.recent.get(value, _MISSING)
+        if result is not _MISSING:
+            self.hits += 1
+            return result
+        result = self.older.get(value, _MISSING)
+        if result is _MISSING:
+            result = self.func(value)
+            self.misses += 1
+        else:
+            self.hits += 1
+        if len(self.recent) >= self.maxsize // 2:
+            self.older = self.recent
+            self.recent = {}
+        self.recent[value] = result
+        return result
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self.recent) + len(self.older), 'maxsize': self.maxsize}
+
+clean_street = CachedCleaner(street_normalizer.normalize)
+clean_state = CachedCleaner(lambda name: update_state(name, mapping_state))
+clean_zipcode = CachedCleaner(update_zipcode)
+
+# The cleaner applied to the value of each address tag
+CLEANERS = {"addr:street": clean_street,
+            "addr:state": clean_state,
+            "addr:postcode": clean_zipcode}
+
+def cache_stats():
+    """Hit/miss counters of the cleaners, by tag key"""
+    return dict((k, cleaner.stats()) for k, cleaner in CLEANERS.items())
+
+def clear_caches():
+    street_normalizer.build()
+    zipcode_table.specs = zipcode_ranges
+    zipcode_table.build()
+    for cleaner in CLEANERS.values():
+        cleaner.clear()
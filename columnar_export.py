@@ -0,0 +1,164 @@
+# coding: utf-8
+
+# =====================================
+# Columnar (Parquet) export of the OSM tables
+# =====================================
+#
+# export_osm writes the node, way and relation tables as Parquet files with
+# typed columns (integer ids, float lat/lon), dictionary encoding of the
+# repetitive text columns (user, key, type, member_type, role) and delta
+# encoding of the id and position columns, so that the tables can be
+# reloaded without re-parsing text:
+#
+#   table = read_table('parquet/nodes.parquet')
+#
+# Requires the optional pyarrow package. Delta encoding needs pyarrow >= 7,
+# which does not support Python 2: with the pyarrow releases available for
+# this code the id and position columns are plain encoded (and compressed).
+
+import os
+import re
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+from osm_stream import get_element
+from process_osm import shape_record, ELEMENT_TAGS
+
+# Column types of each table, in csv/sql column order
+COLUMN_TYPES = {
+    'nodes': [('id', 'int64'), ('lat', 'float64'), ('lon', 'float64'), ('user', 'string'),
+              ('uid', 'int64'), ('version', 'int32'), ('changeset', 'int64'),
+              ('timestamp', 'string')],
+    'nodes_tags': [('id', 'int64'), ('key', 'string'), ('value', 'string'), ('type', 'string')],
+    'ways': [('id', 'int64'), ('user', 'string'), ('uid', 'int64'), ('version', 'int32'),
+             ('changeset', 'int64'), ('timestamp', 'string')],
+    'ways_nodes': [('id', 'int64'), ('node_id', 'int64'), ('position', 'int32')],
+    'ways_tags': [('id', 'int64'), ('key', 'string'), ('value', 'string'), ('type', 'string')],
+    'relations': [('id', 'int64'), ('user', 'string'), ('uid', 'int64'), ('version', 'int32'),
+                  ('changeset', 'int64'), ('timestamp', 'string')],
+    'relations_members': [('id', 'int64'), ('member_id', 'int64'), ('member_type', 'string'),
+                          ('role', 'string'), ('position', 'int32')],
+    'relations_tags': [('id', 'int64'), ('key', 'string'), ('value', 'string'),
+                       ('type', 'string')],
+}
+TABLE_NAMES = ['nodes', 'nodes_tags', 'ways', 'ways_nodes', 'ways_tags',
+               'relations', 'relations_members', 'relations_tags']
+
+DICTIONARY_COLUMNS = ['user', 'key', 'type', 'member_type', 'role']
+DELTA_COLUMNS = ['id', 'node_id', 'position', 'changeset']
+
+# First pyarrow release whose ParquetWriter takes column_encoding
+COLUMN_ENCODING_VERSION = (7, 0)
+
+# Python conversion of the text attribute values for each column type
+CONVERTERS = {'int64': int, 'int32': int, 'float64': float, 'string': None}
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("the columnar export requires the pyarrow package")
+
+
+def pyarrow_version():
+    """(major, minor) of the installed pyarrow"""
+    return tuple(int(part) for part in re.findall(r'\d+', pa.__version__)[:2])
+
+
+def arrow_schema(table):
+    _require_pyarrow()
+    return pa.schema([(name, getattr(pa, type_name)()) for name, type_name in COLUMN_TYPES[table]])
+
+
+def _open_writer(path, table, compression):
+    schema = arrow_schema(table)
+    names = schema.names
+    dictionary = [c for c in DICTIONARY_COLUMNS if c in names]
+    if pyarrow_version() < COLUMN_ENCODING_VERSION:
+        return pq.ParquetWriter(path, schema, compression=compression, use_dictionary=dictionary)
+    delta = dict((c, 'DELTA_BINARY_PACKED') for c in DELTA_COLUMNS if c in names)
+    return pq.ParquetWriter(path, schema, compression=compression,
+                            use_dictionary=dictionary, column_encoding=delta)
+
+
+def rows_to_table(table, rows):
+    """Convert rows (tuples of attribute strings) into a typed pyarrow Table"""
+    schema = arrow_schema(table)
+    columns = zip(*rows) if rows else [[] for _ in COLUMN_TYPES[table]]
+    arrays = []
+    for (name, type_name), column in zip(COLUMN_TYPES[table], columns):
+        convert = CONVERTERS[type_name]
+        values = [convert(v) for v in column] if convert is not None else list(column)
+        arrays.append(pa.array(values, type=schema.field(name).type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+class ColumnarWriter(object):
+    """Buffers the rows of the tables and writes them as row groups"""
+
+    def __init__(self, out_dir, row_group_size=500000, compression='snappy'):
+        _require_pyarrow()
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        self.row_group_size = row_group_size
+        self.paths = dict((table, os.path.join(out_dir, table + '.parquet'))
+                          for table in TABLE_NAMES)
+        self.writers = dict((table, _open_writer(self.paths[table], table, compression))
+                            for table in TABLE_NAMES)
+        self.buffers = dict((table, []) for table in TABLE_NAMES)
+
+    def add(self, record):
+        """Add the rows of a shaped element (process_osm.ShapedElement)"""
+        if record.tag == 'node':
+            self._extend('nodes', [record.attribs])
+            self._extend('nodes_tags', record.tags)
+        elif record.tag == 'relation':
+            self._extend('relations', [record.attribs])
+            self._extend('relations_members', record.members)
+            self._extend('relations_tags', record.tags)
+        else:
+            self._extend('ways', [record.attribs])
+            self._extend('ways_nodes', record.way_nodes)
+            self._extend('ways_tags', record.tags)
+
+    def _extend(self, table, rows):
+        buf = self.buffers[table]
+        buf.extend(rows)
+        if len(buf) >= self.row_group_size:
+            self._write(table)
+
+    def _write(self, table):
+        buf = self.buffers[table]
+        if buf:
+            self.writers[table].write_table(rows_to_table(table, buf))
+            del buf[:]
+
+    def close(self):
+        for table in TABLE_NAMES:
+            self._write(table)
+            self.writers[table].close()
+
+
+def export_osm(file_in, out_dir, row_group_size=500000, compression='snappy'):
+    """Shape the elements of an OSM file into <out_dir>/<table>.parquet
+
+    Returns the paths of the written files, by table name.
+    """
+    writer = ColumnarWriter(out_dir, row_group_size, compression)
+    try:
+        for element in get_element(file_in, tags=ELEMENT_TAGS):
+            record = shape_record(element)
+            if record:
+                writer.add(record)
+    finally:
+        writer.close()
+    return writer.paths
+
+
+def read_table(path, columns=None):
+    """Read a table written by export_osm (a pyarrow Table)"""
+    _require_pyarrow()
+    return pq.read_table(path, columns=columns)
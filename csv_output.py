@@ -0,0 +1,105 @@
+# coding: utf-8
+
+# =====================================
+# Fast CSV output
+# =====================================
+#
+# CSVWriter writes rows (sequences in column order) through csv.writer into an
+# in-memory buffer which is written out in large chunks, optionally through
+# gzip or zstandard compression. The bytes written are the same as with
+# csv.DictWriter and UTF-8 encoded values.
+
+import csv
+import gzip
+from cStringIO import StringIO
+
+# Size of the chunks written to the output file
+CHUNK_SIZE = 1 << 20
+
+COMPRESSION_SUFFIXES = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+
+def output_path(path, compression=None):
+    """Path of a csv file with the suffix of its compression"""
+    return path + COMPRESSION_SUFFIXES[compression]
+
+
+def open_output(path, compression=None):
+    """Open a binary output file, compressed with gzip or zstd if asked
+
+    zstd needs the optional zstandard package.
+    """
+    if compression is None:
+        return open(path, 'wb')
+    if compression == 'gzip':
+        return gzip.open(path, 'wb')
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("zstd compression requires the zstandard package")
+        return zstandard.ZstdCompressor().stream_writer(open(path, 'wb'))
+    raise ValueError("unknown compression: {0!r}".format(compression))
+
+
+def _encode(row):
+    return [v.encode('utf-8') if isinstance(v, unicode) else v for v in row]
+
+
+class CSVWriter(object):
+    """Buffered, positional replacement of UnicodeDictWriter"""
+
+    def __init__(self, f, fieldnames, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.fieldnames = fieldnames
+        self.chunk_size = chunk_size
+        self.buffer = StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.bytes_written = 0
+        self.rows_written = 0
+        self._current = None
+
+    def writeheader(self):
+        self.writer.writerow(self.fieldnames)
+
+    def writerow(self, row):
+        self.rows_written += 1
+        try:
+            self.writer.writerow(row)
+        except UnicodeEncodeError:
+            self.writer.writerow(_encode(row))
+        if self.buffer.tell() >= self.chunk_size:
+            self.flush()
+
+    def _track(self, rows):
+        for row in rows:
+            self._current = row
+            yield row
+
+    def writerows(self, rows):
+        # csv.writer only handles non-ASCII unicode values once encoded;
+        # these are rare, so the rows are written as they are and only the
+        # row that failed is encoded before going on with the rest
+        try:
+            self.rows_written += len(rows)
+        except TypeError:
+            rows = list(rows)
+            self.rows_written += len(rows)
+        rows = self._track(rows)
+        while True:
+            try:
+                self.writer.writerows(rows)
+                break
+            except UnicodeEncodeError:
+                self.writer.writerow(_encode(self._current))
+        if self.buffer.tell() >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered rows to the output file"""
+        if self.buffer.tell():
+            data = self.buffer.getvalue()
+            self.f.write(data)
+            self.bytes_written += len(data)
+            self.buffer.seek(0)
+            self.buffer.truncate()
@@ -0,0 +1,183 @@
+# coding: utf-8
+
+# =====================================
+# Compiled schema validation
+# =====================================
+#
+# cerberus interprets the nested schema.py rules for every element, which
+# costs several times more than parsing and shaping it. FastValidator compiles
+# a schema once into plain Python check functions covering the rules used in
+# schema.py (required, type, coerce and nested dict/list schemas). Documents
+# that pass the compiled checks are valid; for the rare ones that do not,
+# the document is validated again by cerberus so that `errors` (and therefore
+# the messages raised by validate_element) are exactly the same as before.
+#
+# compile_rows checks the same rules on the tuple rows of the shaped records
+# (process_osm.ShapedElement), in column order, so that valid elements are
+# validated without building their dict document.
+
+import cerberus
+
+try:
+    _STRING_TYPES = (basestring,)
+    _INTEGER_TYPES = (int, long)
+except NameError:
+    _STRING_TYPES = (str,)
+    _INTEGER_TYPES = (int,)
+
+# Type checks of the cerberus types used in schema.py
+TYPE_CHECKS = {
+    'string': lambda value: isinstance(value, _STRING_TYPES),
+    'integer': lambda value: isinstance(value, _INTEGER_TYPES) and not isinstance(value, bool),
+    'float': lambda value: isinstance(value, float),
+    'dict': lambda value: isinstance(value, dict),
+    'list': lambda value: isinstance(value, list),
+}
+
+SUPPORTED_RULES = set(['required', 'type', 'coerce', 'schema'])
+
+
+def compile_field(rules):
+    """Compile the rules of one field into a function value -> bool"""
+    unsupported = set(rules) - SUPPORTED_RULES
+    if unsupported:
+        raise ValueError("rules not supported by the compiled validator: {0}".format(
+            ', '.join(sorted(unsupported))))
+
+    coerce = rules.get('coerce')
+    type_check = TYPE_CHECKS[rules['type']] if 'type' in rules else None
+    nested = None
+    if 'schema' in rules:
+        if rules.get('type') == 'list':
+            nested = compile_field(rules['schema'])
+        else:
+            nested = compile_schema(rules['schema'])
+
+    def check(value):
+        if value is None:
+            return False
+        if coerce is not None:
+            try:
+                value = coerce(value)
+            except Exception:
+                return False
+        if type_check is not None and not type_check(value):
+            return False
+        if nested is not None:
+            if isinstance(value, list):
+                for item in value:
+                    if not nested(item):
+                        return False
+            elif not nested(value):
+                return False
+        return True
+
+    return check
+
+
+def compile_schema(schema):
+    """Compile a cerberus schema (dict of field rules) into a function
+    document -> bool"""
+    fields = dict((name, compile_field(rules)) for name, rules in schema.items())
+    required = frozenset(name for name, rules in schema.items() if rules.get('required'))
+
+    def check(document):
+        if not isinstance(document, dict):
+            return False
+        if not required.issubset(document):
+            return False
+        for name, value in document.items():
+            field = fields.get(name)
+            if field is None or not field(value):
+                return False
+        return True
+
+    return check
+
+
+def compile_row(rules, fields):
+    """Compile the rules of a dict field into a function checking its value
+    given as a tuple of the values of `fields`"""
+    if rules.get('type') != 'dict' or set(rules) - set(['type', 'schema', 'required']):
+        raise ValueError("only dict fields can be checked as rows")
+    schema = rules['schema']
+    required = set(name for name, field_rules in schema.items() if field_rules.get('required'))
+    if not required.issubset(fields) or not set(fields).issubset(schema):
+        return lambda row: False
+    checks = [compile_field(schema[name]) for name in fields]
+    length = len(fields)
+
+    def check(row):
+        if len(row) != length:
+            return False
+        for field, value in zip(checks, row):
+            if not field(value):
+                return False
+        return True
+
+    return check
+
+
+def compile_rows(schema, layout):
+    """Compile a schema for documents given as rows: layout lists the
+    (name, fields) of the top-level fields, each being a row (dict rules) or
+    a list of rows (list of dict rules); returns a function checking the
+    sequence of their values in layout order"""
+    checks = []
+    for name, fields in layout:
+        rules = schema[name]
+        if rules.get('type') == 'list':
+            row_check = compile_row(rules['schema'], fields)
+
+            def check(rows, row_check=row_check):
+                if not isinstance(rows, list):
+                    return False
+                for row in rows:
+                    if not row_check(row):
+                        return False
+                return True
+
+            checks.append(check)
+        else:
+            checks.append(compile_row(rules, fields))
+    if set(name for name, rules in schema.items() if rules.get('required')) - \
+            set(name for name, _ in layout):
+        return lambda values: False
+
+    def check_all(values):
+        for check, value in zip(checks, values):
+            if value is None or not check(value):
+                return False
+        return True
+
+    return check_all
+
+
+class FastValidator(object):
+    """Drop-in replacement of cerberus.Validator for validate_element"""
+
+    def __init__(self):
+        self._compiled = {}
+        self._cerberus = cerberus.Validator()
+        self.errors = {}
+
+    def validate(self, document, schema):
+        compiled = self._compiled.get(id(schema))
+        if compiled is None:
+            # keep a reference to the schema so that its id is not reused
+            compiled = self._compiled[id(schema)] = (schema, compile_schema(schema))
+        if compiled[1](document):
+            self.errors = {}
+            return True
+        result = self._cerberus.validate(document, schema)
+        self.errors = self._cerberus.errors
+        return result
+
+    def check_rows(self, values, layout, schema):
+        """True if the rows (see compile_rows) match the schema; otherwise
+        their document must be validated for the errors"""
+        key = (id(schema), id(layout))
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            compiled = self._compiled[key] = (schema, layout, compile_rows(schema, layout))
+        return compiled[2](values)
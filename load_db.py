@@ -0,0 +1,280 @@
+# coding: utf-8
+
+# =====================================
+# Direct loading of the OSM file into SQLite
+# =====================================
+#
+# load_osm shapes (and optionally validates) the elements exactly like
+# process_map, but inserts the rows straight into the database instead of
+# writing the CSV files and reading them back.
+
+import csv
+import os
+import sqlite3
+from itertools import islice
+
+from fast_validator import FastValidator
+from osm_stream import element_stream
+from queries import INDEX_SQL
+from spatial import RTREE_TABLE, SPATIAL_INDEX_SQL, has_spatial_index
+from tag_stats import TagStats, create_stats_tables, has_stats_tables, rebuild_stats
+from process_osm import (shape_record, validate_record, ELEMENT_TAGS, NODE_FIELDS,
+                         NODE_TAGS_FIELDS, WAY_FIELDS, WAY_NODES_FIELDS, WAY_TAGS_FIELDS,
+                         RELATION_FIELDS, RELATION_MEMBERS_FIELDS, RELATION_TAGS_FIELDS,
+                         NODES_PATH, NODE_TAGS_PATH, WAYS_PATH, WAY_NODES_PATH, WAY_TAGS_PATH,
+                         RELATIONS_PATH, RELATION_MEMBERS_PATH, RELATION_TAGS_PATH)
+
+# The tables of the database, in loading order
+TABLES = [
+    ('nodes', '''CREATE TABLE nodes (
+    id INTEGER PRIMARY KEY NOT NULL,
+    lat REAL,
+    lon REAL,
+    user TEXT,
+    uid INTEGER,
+    version INTEGER,
+    changeset INTEGER,
+    timestamp TEXT);''', NODE_FIELDS),
+    ('nodes_tags', '''CREATE TABLE nodes_tags (
+    id INTEGER,
+    key TEXT,
+    value TEXT,
+    type TEXT,
+    FOREIGN KEY (id) REFERENCES nodes(id));''', NODE_TAGS_FIELDS),
+    ('ways', '''CREATE TABLE ways (
+    id INTEGER PRIMARY KEY NOT NULL,
+    user TEXT,
+    uid INTEGER,
+    version TEXT,
+    changeset INTEGER,
+    timestamp TEXT);''', WAY_FIELDS),
+    ('ways_tags', '''CREATE TABLE ways_tags (
+    id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    type TEXT,
+    FOREIGN KEY (id) REFERENCES ways(id));''', WAY_TAGS_FIELDS),
+    ('ways_nodes', '''CREATE TABLE ways_nodes (
+    id INTEGER NOT NULL,
+    node_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    FOREIGN KEY (id) REFERENCES ways(id),
+    FOREIGN KEY (node_id) REFERENCES nodes(id));''', WAY_NODES_FIELDS),
+    ('relations', '''CREATE TABLE relations (
+    id INTEGER PRIMARY KEY NOT NULL,
+    user TEXT,
+    uid INTEGER,
+    version TEXT,
+    changeset INTEGER,
+    timestamp TEXT);''', RELATION_FIELDS),
+    ('relations_tags', '''CREATE TABLE relations_tags (
+    id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    type TEXT,
+    FOREIGN KEY (id) REFERENCES relations(id));''', RELATION_TAGS_FIELDS),
+    # member_id is not a foreign key: relations often have members outside
+    # of the extract
+    ('relations_members', '''CREATE TABLE relations_members (
+    id INTEGER NOT NULL,
+    member_id INTEGER NOT NULL,
+    member_type TEXT NOT NULL,
+    role TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    FOREIGN KEY (id) REFERENCES relations(id));''', RELATION_MEMBERS_FIELDS),
+]
+
+# The CSV file written by process_map for each table
+TABLE_CSV_PATHS = {'nodes': NODES_PATH, 'nodes_tags': NODE_TAGS_PATH, 'ways': WAYS_PATH,
+                   'ways_tags': WAY_TAGS_PATH, 'ways_nodes': WAY_NODES_PATH,
+                   'relations': RELATIONS_PATH, 'relations_tags': RELATION_TAGS_PATH,
+                   'relations_members': RELATION_MEMBERS_PATH}
+
+# Settings for the bulk load: no rollback journal on disk, no fsync and a
+# 256 MB page cache. A failed load leaves a database that must be rebuilt.
+LOAD_PRAGMAS = ['PRAGMA journal_mode=MEMORY',
+                'PRAGMA synchronous=OFF',
+                'PRAGMA cache_size=-262144',
+                'PRAGMA temp_store=MEMORY',
+                'PRAGMA foreign_keys=OFF']
+
+# Settings restored once the load is finished
+DEFAULT_PRAGMAS = ['PRAGMA journal_mode=DELETE',
+                   'PRAGMA synchronous=FULL',
+                   'PRAGMA foreign_keys=ON']
+
+# Statements run after the load, see finish_load: the R*Tree of the nodes,
+# then the secondary indexes and ANALYZE
+POST_LOAD_SQL = SPATIAL_INDEX_SQL + INDEX_SQL
+
+# Statements run after an append: the existing indexes and R*Tree have been
+# updated by the inserts
+APPEND_SQL = ['ANALYZE;']
+
+# Positions of the coordinates in the node rows, for the R*Tree
+NODE_ID, NODE_LAT, NODE_LON = [NODE_FIELDS.index(field) for field in ('id', 'lat', 'lon')]
+
+
+def insert_sql(table, fields):
+    return 'INSERT INTO {0} ({1}) VALUES ({2});'.format(
+        table, ', '.join(fields), ','.join('?' * len(fields)))
+
+
+def create_tables(con):
+    """Create the tables of the database (dropping existing ones)"""
+    for table, create, _ in TABLES:
+        con.execute('DROP TABLE IF EXISTS {0};'.format(table))
+        con.execute(create)
+    con.commit()
+
+
+def finish_load(con, append=False):
+    """Run the post-load statements (after an append, only ANALYZE, and the
+    R*Tree if the database has none), restore the default settings and
+    return the foreign key violations found in the loaded data"""
+    if not append:
+        statements = POST_LOAD_SQL
+    elif has_spatial_index(con):
+        statements = APPEND_SQL
+    else:
+        statements = SPATIAL_INDEX_SQL + APPEND_SQL
+    for statement in statements:
+        con.execute(statement)
+    con.commit()
+    for pragma in DEFAULT_PRAGMAS:
+        con.execute(pragma)
+    return con.execute('PRAGMA foreign_key_check;').fetchall()
+
+
+def load_osm(file_in, db_path, validate=False, batch_size=50000, append=False, profile=None,
+             workers=1):
+    """Shape the elements of an OSM file and insert them into db_path
+
+    Rows are buffered per table and inserted with executemany (one cached
+    prepared statement per table) in transactions of about batch_size rows,
+    and the statistics tables of tag_stats.py are updated with each batch.
+    With append=True the rows are added to the existing tables instead of
+    recreating them; their indexes and R*Tree are updated by the inserts
+    instead of being rebuilt. Returns the list of foreign key violations
+    (e.g. ways referring to nodes outside of the extract). profile (a
+    profiling.Profile) times the parse, shape, validate and insert stages.
+    The blocks of a PBF file are decoded by `workers` processes.
+    """
+    con = sqlite3.connect(db_path)
+    con.text_factory = str
+    try:
+        for pragma in LOAD_PRAGMAS:
+            con.execute(pragma)
+        if not append:
+            create_tables(con)
+            create_stats_tables(con)
+        elif not has_stats_tables(con):
+            rebuild_stats(con)
+
+        statements = [(table, insert_sql(table, fields)) for table, _, fields in TABLES]
+        # appended nodes go into the existing R*Tree, which is not rebuilt
+        spatial = append and has_spatial_index(con)
+        if spatial:
+            statements.append((RTREE_TABLE, 'INSERT INTO {0} VALUES (?,?,?,?,?);'.format(
+                RTREE_TABLE)))
+        buffers = dict((table, []) for table, _ in statements)
+        buffered = 0
+        validator = FastValidator()
+        stats = TagStats()
+
+        def flush():
+            for table, sql in statements:
+                if buffers[table]:
+                    con.executemany(sql, buffers[table])
+                    del buffers[table][:]
+            stats.flush(con)
+            con.commit()
+
+        def check(record):
+            validate_record(record, validator)
+
+        def add(record):
+            """Buffer the rows of a record; returns the number of rows"""
+            stats.add(record)
+            if record.tag == 'node':
+                attribs = record.attribs
+                buffers['nodes'].append(attribs)
+                buffers['nodes_tags'].extend(record.tags)
+                if spatial:
+                    lat, lon = float(attribs[NODE_LAT]), float(attribs[NODE_LON])
+                    buffers[RTREE_TABLE].append((attribs[NODE_ID], lat, lat, lon, lon))
+                return 1 + len(record.tags)
+            if record.tag == 'relation':
+                buffers['relations'].append(record.attribs)
+                buffers['relations_tags'].extend(record.tags)
+                buffers['relations_members'].extend(record.members)
+                return 1 + len(record.tags) + len(record.members)
+            buffers['ways'].append(record.attribs)
+            buffers['ways_tags'].extend(record.tags)
+            buffers['ways_nodes'].extend(record.way_nodes)
+            return 1 + len(record.tags) + len(record.way_nodes)
+
+        shape = shape_record
+        with open(file_in, 'rb') as osm_file:
+            stream = element_stream(osm_file, tags=ELEMENT_TAGS, workers=workers)
+            elements = iter(stream)
+            if profile is not None:
+                profile.info.update([('input', file_in),
+                                     ('input_bytes', os.path.getsize(file_in)),
+                                     ('validate', validate is True)])
+                profile.total_bytes = os.path.getsize(file_in)
+                profile.start()
+                elements = profile.iter('parse', elements, lambda: stream.position)
+                shape = profile.timed('shape', shape)
+                if validate is True:
+                    check = profile.timed('validate', check)
+                add = profile.timed('insert', add)
+                flush = profile.timed('insert', flush, count=False)
+
+            for element in elements:
+                record = shape(element)
+                if not record:
+                    continue
+                if validate is True:
+                    check(record)
+                buffered += add(record)
+                if buffered >= batch_size:
+                    flush()
+                    buffered = 0
+            flush()
+        if profile is not None:
+            violations = profile.timed('indexes', finish_load, count=False)(con, append)
+            profile.stop()
+            return violations
+        return finish_load(con, append)
+    finally:
+        con.close()
+
+
+def load_csv(db_path, csv_paths=TABLE_CSV_PATHS, batch_size=50000):
+    """Load the CSV files written by process_map into db_path
+
+    The tables are recreated, then indexed and their statistics tables
+    rebuilt. Returns the list of foreign key violations.
+    """
+    con = sqlite3.connect(db_path)
+    con.text_factory = str
+    try:
+        for pragma in LOAD_PRAGMAS:
+            con.execute(pragma)
+        create_tables(con)
+        for table, _, fields in TABLES:
+            sql = insert_sql(table, fields)
+            with open(csv_paths[table], 'rb') as f:
+                reader = csv.reader(f)
+                next(reader)
+                while True:
+                    rows = list(islice(reader, batch_size))
+                    if not rows:
+                        break
+                    con.executemany(sql, rows)
+            con.commit()
+        rebuild_stats(con)
+        return finish_load(con)
+    finally:
+        con.close()
@@ -0,0 +1,248 @@
+# coding: utf-8
+
+# =====================================
+# Node location stores and way geometries
+# =====================================
+#
+# The locations of the nodes are kept in memory-mapped files of fixed-point
+# coordinates (8 bytes per node, no Python object per node), so that ways can
+# be turned into coordinate sequences during the same streaming pass that
+# reads the nodes, without a join over ways_nodes:
+#
+#   for way_id, coords in way_geometries('boston_massachusetts.osm'):
+#       ...
+#
+# Two stores are available:
+#
+#   DenseLocationStore   array indexed by node id; lookups are one read, but
+#                        the (sparse) file spans 8 bytes * the largest id, and
+#                        negative ids (new nodes of editors) are rejected
+#   SparseLocationStore  sorted arrays of ids and coordinates, 16 bytes per
+#                        stored node, lookups by binary search; needs the
+#                        nodes in increasing id order, as in OSM files
+#
+# Latitudes and longitudes are stored as signed 32-bit integers in 1e-7
+# degrees (the precision of OSM). The dense store keeps them offset by 2**31,
+# so that the zero bytes of the slots never written read as INT32_MIN, which
+# is no valid coordinate and marks a missing node.
+
+import mmap
+import struct
+import tempfile
+from array import array
+from bisect import bisect_left, bisect_right
+
+from osm_stream import get_element
+
+COORD_SCALE = 10000000
+
+# Stored location: (lat, lon) in 1e-7 degrees
+LOCATION = struct.Struct('<ii')
+NODE_ID = struct.Struct('<q')
+
+# Slot of the dense store: (lat, lon) - INT32_MIN, all zero when empty
+DENSE_SLOT = struct.Struct('<II')
+INT32_MIN = -2 ** 31
+
+# Initial size of the dense store file (grown by doubling)
+DENSE_INITIAL_BYTES = 1 << 24
+
+# Number of ids per block of the in-memory index of the sparse store
+SPARSE_BLOCK = 256
+
+
+def encode_location(lat, lon):
+    return (int(round(lat * COORD_SCALE)), int(round(lon * COORD_SCALE)))
+
+
+def decode_location(lat_e, lon_e):
+    return (round(float(lat_e) / COORD_SCALE, 7), round(float(lon_e) / COORD_SCALE, 7))
+
+
+def _open_file(path):
+    if path is None:
+        return tempfile.TemporaryFile()
+    return open(path, 'w+b')
+
+
+class LocationStore(object):
+    """Common interface of the stores: set, get, resolve and close"""
+
+    def set(self, node_id, lat, lon):
+        raise NotImplementedError
+
+    def get(self, node_id):
+        """(lat, lon) of a node, or None if it is not stored"""
+        raise NotImplementedError
+
+    def resolve(self, node_ids):
+        """Coordinates of a sequence of node ids (None for missing nodes)"""
+        get = self.get
+        return [get(node_id) for node_id in node_ids]
+
+    def close(self):
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DenseLocationStore(LocationStore):
+    """Locations at offset 8 * node id of a memory-mapped (sparse) file;
+    node ids must not be negative"""
+
+    def __init__(self, path=None, initial_bytes=DENSE_INITIAL_BYTES):
+        self.f = _open_file(path)
+        self.f.truncate(initial_bytes)
+        self.mm = mmap.mmap(self.f.fileno(), initial_bytes)
+        self.size = initial_bytes
+
+    def _grow(self, needed):
+        size = self.size
+        while size < needed:
+            size *= 2
+        self.mm.resize(size)
+        self.size = size
+
+    def set(self, node_id, lat, lon):
+        if node_id < 0:
+            raise ValueError("negative node id {0}: the dense store is indexed by id "
+                             "(use SparseLocationStore)".format(node_id))
+        offset = node_id * DENSE_SLOT.size
+        if offset + DENSE_SLOT.size > self.size:
+            self._grow(offset + DENSE_SLOT.size)
+        lat_e, lon_e = encode_location(lat, lon)
+        DENSE_SLOT.pack_into(self.mm, offset, lat_e - INT32_MIN, lon_e - INT32_MIN)
+
+    def get(self, node_id):
+        if node_id < 0:
+            return None
+        offset = node_id * DENSE_SLOT.size
+        if offset + DENSE_SLOT.size > self.size:
+            return None
+        lat_e, lon_e = DENSE_SLOT.unpack_from(self.mm, offset)
+        lat_e += INT32_MIN
+        if lat_e == INT32_MIN:
+            return None
+        return decode_location(lat_e, lon_e + INT32_MIN)
+
+    def close(self):
+        self.mm.close()
+        self.f.close()
+
+
+class SparseLocationStore(LocationStore):
+    """Sorted node ids and their locations in two memory-mapped files
+
+    The nodes must be set in increasing id order. Rows are appended through
+    a write buffer; the files are (re)mapped on the first lookup after new
+    nodes were set. The first id of every SPARSE_BLOCK ids is kept in memory,
+    so a lookup is a bisect of that index and of one unpacked block.
+    """
+
+    def __init__(self, ids_path=None, locations_path=None):
+        self.ids_file = _open_file(ids_path)
+        self.locations_file = _open_file(locations_path)
+        self.count = 0
+        self.last_id = None
+        self._ids = []
+        self._locations = []
+        self._mapped = 0
+        self.ids_mm = self.locations_mm = None
+        # doubles hold the node ids exactly (< 2**53) on every platform
+        self.index = array('d')
+        self.block = struct.Struct('<{0}q'.format(SPARSE_BLOCK))
+
+    def set(self, node_id, lat, lon):
+        if self.last_id is not None and node_id <= self.last_id:
+            raise ValueError("node {0} after node {1}: the sparse store needs increasing ids "
+                             "(use DenseLocationStore)".format(node_id, self.last_id))
+        self.last_id = node_id
+        if self.count % SPARSE_BLOCK == 0:
+            self.index.append(node_id)
+        self._ids.append(NODE_ID.pack(node_id))
+        self._locations.append(LOCATION.pack(*encode_location(lat, lon)))
+        self.count += 1
+        if len(self._ids) >= 65536:
+            self._flush()
+
+    def _flush(self):
+        if self._ids:
+            self.ids_file.write(''.join(self._ids))
+            self.locations_file.write(''.join(self._locations))
+            self._ids = []
+            self._locations = []
+
+    def _remap(self):
+        self._flush()
+        self.ids_file.flush()
+        self.locations_file.flush()
+        for mm in (self.ids_mm, self.locations_mm):
+            if mm is not None:
+                mm.close()
+        self.ids_mm = mmap.mmap(self.ids_file.fileno(), self.count * NODE_ID.size,
+                                access=mmap.ACCESS_READ)
+        self.locations_mm = mmap.mmap(self.locations_file.fileno(),
+                                      self.count * LOCATION.size, access=mmap.ACCESS_READ)
+        self._mapped = self.count
+
+    def get(self, node_id):
+        if not self.count:
+            return None
+        if self._mapped != self.count:
+            self._remap()
+        block = bisect_right(self.index, node_id) - 1
+        if block < 0:
+            return None
+        start = block * SPARSE_BLOCK
+        if start + SPARSE_BLOCK <= self.count:
+            ids = self.block.unpack_from(self.ids_mm, start * NODE_ID.size)
+        else:
+            ids = struct.unpack_from('<{0}q'.format(self.count - start), self.ids_mm,
+                                     start * NODE_ID.size)
+        i = bisect_left(ids, node_id)
+        if i == len(ids) or ids[i] != node_id:
+            return None
+        return decode_location(*LOCATION.unpack_from(self.locations_mm,
+                                                     (start + i) * LOCATION.size))
+
+    def close(self):
+        for mm in (self.ids_mm, self.locations_mm):
+            if mm is not None:
+                mm.close()
+        self.ids_file.close()
+        self.locations_file.close()
+
+
+STORES = {'dense': DenseLocationStore, 'sparse': SparseLocationStore}
+
+
+def track_locations(elements, store):
+    """Pass the elements through, storing the location of every node"""
+    for element in elements:
+        if element.tag == 'node':
+            attrib = element.attrib
+            store.set(int(attrib['id']), float(attrib['lat']), float(attrib['lon']))
+        yield element
+
+
+def way_geometries(osm_file, store='sparse'):
+    """Yield (way id, [(lat, lon) or None, ...]) for every way of the file,
+    in one pass (the nodes come before the ways in OSM files)
+
+    store is 'sparse', 'dense' or a LocationStore, which is left open.
+    """
+    owned = store in STORES
+    if owned:
+        store = STORES[store]()
+    try:
+        for element in track_locations(get_element(osm_file, tags=('node', 'way')), store):
+            if element.tag == 'way':
+                refs = [int(nd.attrib['ref']) for nd in element.iter('nd')]
+                yield int(element.attrib['id']), store.resolve(refs)
+    finally:
+        if owned:
+            store.close()
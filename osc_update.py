@@ -0,0 +1,184 @@
+# coding: utf-8
+
+# =====================================
+# Incremental updates from OSM change files (.osc)
+# =====================================
+#
+# apply_changes applies the <create>, <modify> and <delete> blocks of an
+# osmChange file to an existing database built by P3_codes.py or load_db.py:
+#
+#   apply_changes('daily.osc.gz', 'boston_massachusetts.db')
+#
+# Created and modified elements are cleaned and shaped by shape_record like
+# during the full load and replace the stored element (its tags and, for
+# ways and relations, its whole list of ways_nodes or relations_members
+# rows, so that the positions stay 0..n-1). A change is only applied if its
+# version is newer than the stored one, so applying the same file twice is
+# harmless. The statistics tables of tag_stats.py and the spatial index of
+# spatial.py, if present, are updated with the difference.
+
+import gzip
+import sqlite3
+import xml.etree.cElementTree as ET
+
+from fast_validator import FastValidator
+from load_db import insert_sql
+from process_osm import (ShapedElement, shape_record, validate_record, NODE_FIELDS,
+                         NODE_TAGS_FIELDS, WAY_FIELDS, WAY_NODES_FIELDS, WAY_TAGS_FIELDS,
+                         RELATION_FIELDS, RELATION_MEMBERS_FIELDS, RELATION_TAGS_FIELDS)
+from spatial import RTREE_TABLE, has_spatial_index
+from tag_stats import TagStats, has_stats_tables
+
+ACTIONS = ('create', 'modify', 'delete')
+
+# Tables of each element type: (element table, fields, tags table, fields)
+ELEMENT_TABLES = {
+    'node': ('nodes', NODE_FIELDS, 'nodes_tags', NODE_TAGS_FIELDS),
+    'way': ('ways', WAY_FIELDS, 'ways_tags', WAY_TAGS_FIELDS),
+    'relation': ('relations', RELATION_FIELDS, 'relations_tags', RELATION_TAGS_FIELDS),
+}
+
+
+def iter_changes(osc_file):
+    """Yield (action, element) for every node, way and relation of an
+    osmChange file, with bounded memory"""
+    context = ET.iterparse(osc_file, events=('start', 'end'))
+    _, root = next(context)
+    depth = 1
+    block = None
+    for event, elem in context:
+        if event == 'start':
+            depth += 1
+            if depth == 2:
+                block = elem
+            continue
+        depth -= 1
+        if depth == 2:
+            if block.tag in ACTIONS and elem.tag in ELEMENT_TABLES:
+                yield block.tag, elem
+            block.clear()
+        elif depth == 1:
+            root.clear()
+
+
+def open_osc(path):
+    return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+
+
+class ChangeApplier(object):
+    """Applies shaped changes to the tables of an open database"""
+
+    def __init__(self, con, validate=False):
+        self.con = con
+        self.validate = validate
+        self.validator = FastValidator()
+        self.stats = TagStats() if has_stats_tables(con) else None
+        self.spatial = has_spatial_index(con)
+        self.tables = set(row[0] for row in con.execute(
+            "SELECT name FROM sqlite_master WHERE type='table';"))
+        self.counts = dict((name, 0) for name in ACTIONS + ('skipped',))
+
+    def stored_version(self, kind, element_id):
+        table = ELEMENT_TABLES[kind][0]
+        row = self.con.execute('SELECT version FROM {0} WHERE id=?;'.format(table),
+                               (element_id,)).fetchone()
+        return None if row is None else int(row[0])
+
+    def stored_record(self, kind, element_id):
+        """The stored element as a ShapedElement"""
+        table, fields, tags_table, tags_fields = ELEMENT_TABLES[kind]
+        attribs = self.con.execute('SELECT {0} FROM {1} WHERE id=?;'.format(
+            ', '.join(fields), table), (element_id,)).fetchone()
+        tags = self.con.execute('SELECT {0} FROM {1} WHERE id=?;'.format(
+            ', '.join(tags_fields), tags_table), (element_id,)).fetchall()
+        way_nodes = members = None
+        if kind == 'way':
+            way_nodes = self.con.execute(
+                'SELECT id, node_id, position FROM ways_nodes WHERE id=? ORDER BY position;',
+                (element_id,)).fetchall()
+        elif kind == 'relation':
+            members = self.con.execute(
+                'SELECT {0} FROM relations_members WHERE id=? ORDER BY position;'.format(
+                    ', '.join(RELATION_MEMBERS_FIELDS)), (element_id,)).fetchall()
+        return ShapedElement(kind, attribs, tags, way_nodes, members)
+
+    def remove(self, kind, element_id):
+        table, _, tags_table, _ = ELEMENT_TABLES[kind]
+        if self.stats is not None:
+            self.stats.add(self.stored_record(kind, element_id), sign=-1)
+        self.con.execute('DELETE FROM {0} WHERE id=?;'.format(tags_table), (element_id,))
+        if kind == 'way':
+            self.con.execute('DELETE FROM ways_nodes WHERE id=?;', (element_id,))
+        elif kind == 'relation':
+            self.con.execute('DELETE FROM relations_members WHERE id=?;', (element_id,))
+        elif self.spatial:
+            self.con.execute('DELETE FROM {0} WHERE id=?;'.format(RTREE_TABLE), (element_id,))
+        self.con.execute('DELETE FROM {0} WHERE id=?;'.format(table), (element_id,))
+
+    def insert(self, record):
+        table, fields, tags_table, tags_fields = ELEMENT_TABLES[record.tag]
+        self.con.execute(insert_sql(table, fields), record.attribs)
+        self.con.executemany(insert_sql(tags_table, tags_fields), record.tags)
+        if record.tag == 'way':
+            self.con.executemany(insert_sql('ways_nodes', WAY_NODES_FIELDS), record.way_nodes)
+        elif record.tag == 'relation':
+            self.con.executemany(insert_sql('relations_members', RELATION_MEMBERS_FIELDS),
+                                 record.members)
+        elif self.spatial:
+            lat, lon = float(record.get('lat')), float(record.get('lon'))
+            self.con.execute('INSERT INTO {0} VALUES (?,?,?,?,?);'.format(RTREE_TABLE),
+                             (record.get('id'), lat, lat, lon, lon))
+        if self.stats is not None:
+            self.stats.add(record)
+
+    def apply(self, action, element):
+        kind = element.tag
+        if ELEMENT_TABLES[kind][0] not in self.tables:
+            # e.g. relations in a database built without the relation tables
+            self.counts['skipped'] += 1
+            return
+        element_id = int(element.attrib['id'])
+        version = int(element.attrib['version'])
+        stored = self.stored_version(kind, element_id)
+        if stored is not None and stored >= version and action != 'delete':
+            self.counts['skipped'] += 1
+            return
+        if action == 'delete':
+            if stored is None or stored > version:
+                self.counts['skipped'] += 1
+                return
+            self.remove(kind, element_id)
+        else:
+            record = shape_record(element)
+            if self.validate is True:
+                validate_record(record, self.validator)
+            if stored is not None:
+                self.remove(kind, element_id)
+            self.insert(record)
+        self.counts[action] += 1
+
+    def flush(self):
+        if self.stats is not None:
+            self.stats.flush(self.con)
+        self.con.commit()
+
+
+def apply_changes(osc_path, db_path, validate=False, batch_size=10000):
+    """Apply an osmChange file (.osc or .osc.gz) to the database
+
+    Changes are committed every batch_size elements. Returns the number of
+    created, modified, deleted and skipped (not newer) elements.
+    """
+    con = sqlite3.connect(db_path)
+    con.text_factory = str
+    try:
+        applier = ChangeApplier(con, validate)
+        with open_osc(osc_path) as osc_file:
+            for n, (action, element) in enumerate(iter_changes(osc_file), 1):
+                applier.apply(action, element)
+                if n % batch_size == 0:
+                    applier.flush()
+        applier.flush()
+        return applier.counts
+    finally:
+        con.close()
@@ -0,0 +1,124 @@
+# coding: utf-8
+
+# =====================================
+# Byte-range sharding of OSM XML files
+# =====================================
+#
+# An OSM file is a flat sequence of <node>, <way> and <relation> elements
+# under the <osm> root, and a literal "<" can only start a tag, so the file
+# can be cut into independent shards at the start of any of these elements.
+# Each shard is parsed on its own by wrapping its bytes in an <osm> root.
+
+import os
+
+ELEMENT_STARTS = ('<node', '<way', '<relation')
+ROOT_END = '</osm>'
+
+# Shards are wrapped in this root so that they are well-formed documents
+SHARD_PREFIX = '<?xml version="1.0" encoding="UTF-8"?>\n<osm>\n'
+SHARD_SUFFIX = '\n</osm>\n'
+
+SCAN_CHUNK = 1 << 20
+
+
+def _is_element_start(buf, pos):
+    """True if the tag name at buf[pos] is exactly node, way or relation"""
+    for start in ELEMENT_STARTS:
+        if buf.startswith(start, pos):
+            return buf[pos + len(start):pos + len(start) + 1] in (' ', '>', '/', '\t', '\n', '\r')
+    return False
+
+
+def find_element_start(f, offset):
+    """Return the offset of the first top-level element start at or after offset"""
+    f.seek(offset)
+    base = offset
+    carry = ''
+    while True:
+        chunk = f.read(SCAN_CHUNK)
+        if not chunk:
+            return None
+        buf = carry + chunk
+        pos = buf.find('<')
+        while pos != -1:
+            if len(buf) - pos < 10 and len(chunk) == SCAN_CHUNK:
+                break
+            if _is_element_start(buf, pos):
+                return base + pos
+            pos = buf.find('<', pos + 1)
+        keep = 10 if len(buf) >= 10 else len(buf)
+        base += len(buf) - keep
+        carry = buf[-keep:]
+
+
+def find_root_end(f, size):
+    """Return the offset of the closing </osm> tag"""
+    pos = size
+    while pos > 0:
+        start = max(0, pos - SCAN_CHUNK)
+        f.seek(start)
+        buf = f.read(pos - start + len(ROOT_END))
+        found = buf.rfind(ROOT_END)
+        if found != -1:
+            return start + found
+        pos = start
+    raise ValueError("no closing </osm> tag found")
+
+
+def split_osm(path, n_shards, offset=0):
+    """Split an OSM file (from offset on) into at most n_shards (start, end)
+    byte ranges, each starting at a <node>, <way> or <relation> element"""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        end = find_root_end(f, size)
+        first = find_element_start(f, offset)
+        if first is None or first >= end:
+            return []
+        starts = [first]
+        for i in range(1, n_shards):
+            start = find_element_start(f, max(first, offset + (size - offset) * i // n_shards))
+            if start is None or start >= end:
+                break
+            if start > starts[-1]:
+                starts.append(start)
+    return zip(starts, starts[1:] + [end])
+
+
+class ShardReader(object):
+    """File-like object reading one byte range wrapped in an <osm> root"""
+
+    def __init__(self, path, start, end):
+        self.f = open(path, 'rb')
+        self.f.seek(start)
+        self.remaining = end - start
+        self.head = SHARD_PREFIX
+        self.tail = SHARD_SUFFIX
+
+    def read(self, size=-1):
+        if size < 0:
+            size = self.remaining + len(self.head) + len(self.tail)
+        out = []
+        if self.head:
+            out.append(self.head[:size])
+            self.head = self.head[size:]
+            size -= len(out[-1])
+        if size > 0 and self.remaining:
+            data = self.f.read(min(size, self.remaining))
+            self.remaining -= len(data)
+            if not data:
+                self.remaining = 0
+            out.append(data)
+            size -= len(data)
+        if size > 0 and not self.remaining:
+            out.append(self.tail[:size])
+            self.tail = self.tail[size:]
+        return ''.join(out)
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
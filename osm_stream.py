@@ -0,0 +1,79 @@
+# coding: utf-8
+
+# =====================================
+# Bounded-memory streaming of OSM XML
+# =====================================
+#
+# Memory ceiling: ElementStream keeps at most one complete top-level element
+# (<node>, <way>, <relation>, <bounds>, ...) alive at a time. Every such
+# element is detached from the root as soon as the consumer moves on to the
+# next one, whether or not its tag was requested, so peak memory is bounded by
+# the parser's read buffer plus the largest single element in the file (for
+# OSM data a way holds at most 2,000 <nd> refs; large relations can reach a
+# few tens of thousands of <member>s, i.e. a few MB) and does not grow with
+# the size of the file. See benchmarks/bench_memory.py for the regression
+# check.
+#
+# Files ending in .pbf are read with pbf_reader.PBFStream instead, which
+# yields the same elements and keeps at most a few decoded blocks alive.
+
+import xml.etree.cElementTree as ET
+
+from pbf_reader import PBFStream
+
+TOP_LEVEL_TAGS = ('node', 'way', 'relation')
+
+
+class ElementStream(object):
+    """Iterate over the complete top-level elements of an OSM XML file.
+
+    Elements are yielded on their "end" event, so all of their children
+    (<tag>, <nd>, <member>) are available. `tags` selects which elements are
+    yielded (None yields all of them); `root` is the <osm> element once
+    iteration has started.
+    """
+
+    def __init__(self, osm_file, tags=TOP_LEVEL_TAGS):
+        self.osm_file = osm_file
+        self.tags = tags
+        self.root = None
+
+    @property
+    def position(self):
+        """Bytes of the file read by the parser so far"""
+        return self.osm_file.tell()
+
+    def __iter__(self):
+        tags = self.tags
+        context = ET.iterparse(self.osm_file, events=('start', 'end'))
+        _, root = next(context)
+        self.root = root
+        depth = 1
+        for event, elem in context:
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 1:
+                if tags is None or elem.tag in tags:
+                    yield elem
+                root.clear()
+
+
+def is_pbf(osm_file):
+    """Whether a path or open file is an OSM PBF file"""
+    name = getattr(osm_file, 'name', osm_file)
+    return isinstance(name, basestring) and name.endswith('.pbf')
+
+
+def element_stream(osm_file, tags=TOP_LEVEL_TAGS, workers=1):
+    """ElementStream of an XML file, or PBFStream (decoding its blocks in
+    `workers` processes) of a PBF file"""
+    if is_pbf(osm_file):
+        return PBFStream(getattr(osm_file, 'name', osm_file), tags, workers)
+    return ElementStream(osm_file, tags)
+
+
+def get_element(osm_file, tags=TOP_LEVEL_TAGS, workers=1):
+    """Yield element if it is the right type of tag"""
+    return iter(element_stream(osm_file, tags, workers))
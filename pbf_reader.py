@@ -0,0 +1,517 @@
+# coding: utf-8
+
+# =====================================
+# OSM PBF input
+# =====================================
+#
+# PBFStream reads .osm.pbf files with a small pure-Python protobuf decoder
+# (no dependency besides zlib) and yields the same elements as the XML
+# ElementStream: <node>, <way> and <relation> Elements with their attributes
+# as strings and their <tag>, <nd> and <member> children, so shape_record,
+# the auditors and the loaders consume them unchanged. get_element and
+# audit() pick it for files ending in .pbf:
+#
+#   for element in get_element('boston_massachusetts.osm.pbf', ('node', 'way')):
+#       ...
+#
+# The file is a sequence of independently compressed blobs of about 8000
+# elements. With workers > 1 the blobs are decompressed and decoded in a
+# process pool (a few blobs ahead of the consumer) and only the conversion
+# into Elements is done by the caller's process.
+#
+# Coordinates are written with up to 7 decimals (trailing zeros trimmed) and
+# timestamps in ISO 8601, like in the XML extracts. zlib and uncompressed blobs are supported,
+# zstd ones with the optional zstandard package.
+
+import multiprocessing
+import struct
+import time
+import xml.etree.cElementTree as ET
+import zlib
+from collections import deque
+
+TOP_LEVEL_TAGS = ('node', 'way', 'relation')
+
+# Features of the header block this reader understands
+SUPPORTED_FEATURES = set(['OsmSchema-V0.6', 'DenseNodes'])
+
+MEMBER_TYPES = ('node', 'way', 'relation')
+
+# Decoded blobs kept in flight per worker
+AHEAD_PER_WORKER = 2
+
+_BLOB_HEADER_SIZE = struct.Struct('>I')
+
+
+# =====================================
+# Protobuf wire format
+# =====================================
+
+def _varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _signed(n):
+    """int32/int64 fields: negative values are 64-bit two's complement"""
+    return n - (1 << 64) if n >= (1 << 63) else n
+
+
+def _zigzag(n):
+    return (n >> 1) ^ -(n & 1)
+
+
+def _coordinate(nanodegrees):
+    return '{0:.7f}'.format(nanodegrees * 1e-9).rstrip('0').rstrip('.')
+
+
+def _fields(buf, pos, end):
+    """Yield (field number, value) of a message; the value of a
+    length-delimited field is its (start, end) range in buf"""
+    while pos < end:
+        key, pos = _varint(buf, pos)
+        number = key >> 3
+        wire_type = key & 7
+        if wire_type == 0:
+            value, pos = _varint(buf, pos)
+        elif wire_type == 2:
+            length, pos = _varint(buf, pos)
+            value = (pos, pos + length)
+            pos += length
+        elif wire_type == 1:
+            value = struct.unpack_from('<Q', buf, pos)[0]
+            pos += 8
+        elif wire_type == 5:
+            value = struct.unpack_from('<I', buf, pos)[0]
+            pos += 4
+        else:
+            raise ValueError("unsupported protobuf wire type {0}".format(wire_type))
+        yield number, value
+
+
+def _unpack_varints(buf, span):
+    """Values of a packed repeated varint field"""
+    pos, end = span
+    values = []
+    append = values.append
+    result = shift = 0
+    while pos < end:
+        b = buf[pos]
+        pos += 1
+        if b < 0x80:
+            append(result | (b << shift))
+            result = shift = 0
+        else:
+            result |= (b & 0x7f) << shift
+            shift += 7
+    return values
+
+
+def _packed(buf, value):
+    """A repeated varint field, packed (range) or not (single value)"""
+    return _unpack_varints(buf, value) if isinstance(value, tuple) else [value]
+
+
+def _deltas(values):
+    """Zigzag decoded running sums of delta coded values"""
+    total = 0
+    out = []
+    append = out.append
+    for n in values:
+        total += (n >> 1) ^ -(n & 1)
+        append(total)
+    return out
+
+
+def _unpack_deltas(buf, span):
+    """_deltas of a packed field, decoded in the same loop"""
+    pos, end = span
+    values = []
+    append = values.append
+    total = result = shift = 0
+    while pos < end:
+        b = buf[pos]
+        pos += 1
+        if b < 0x80:
+            result |= b << shift
+            total += (result >> 1) ^ -(result & 1)
+            append(total)
+            result = shift = 0
+        else:
+            result |= (b & 0x7f) << shift
+            shift += 7
+    return values
+
+
+def _packed_deltas(buf, value):
+    return _unpack_deltas(buf, value) if isinstance(value, tuple) else _deltas([value])
+
+
+# =====================================
+# Blocks
+# =====================================
+
+def _string(data):
+    """str for ASCII, unicode otherwise (like cElementTree)"""
+    try:
+        data.decode('ascii')
+        return data
+    except UnicodeDecodeError:
+        return data.decode('utf-8')
+
+
+class _Block(object):
+    """Decoding context of a PrimitiveBlock"""
+
+    def __init__(self, buf):
+        self.buf = buf
+        self.strings = []
+        self.granularity = 100
+        self.lat_offset = self.lon_offset = 0
+        self.date_granularity = 1000
+        self.groups = []
+        self.timestamps = {}
+        data = str(buf)
+        for number, value in _fields(buf, 0, len(buf)):
+            if number == 1:
+                self.strings = [_string(data[s:e]) for n, (s, e) in _fields(buf, *value)
+                                if n == 1]
+            elif number == 2:
+                self.groups.append(value)
+            elif number == 17:
+                self.granularity = value
+            elif number == 18:
+                self.date_granularity = value
+            elif number == 19:
+                self.lat_offset = _signed(value)
+            elif number == 20:
+                self.lon_offset = _signed(value)
+
+    def lat(self, raw):
+        return _coordinate(self.lat_offset + self.granularity * raw)
+
+    def lon(self, raw):
+        return _coordinate(self.lon_offset + self.granularity * raw)
+
+    def timestamp(self, raw):
+        # elements of a block share few distinct timestamps
+        text = self.timestamps.get(raw)
+        if text is None:
+            text = self.timestamps[raw] = time.strftime(
+                '%Y-%m-%dT%H:%M:%SZ', time.gmtime(raw * self.date_granularity // 1000))
+        return text
+
+    def info(self, attrib, span):
+        strings = self.strings
+        for number, value in _fields(self.buf, *span):
+            if number == 1:
+                attrib['version'] = str(_signed(value))
+            elif number == 2:
+                attrib['timestamp'] = self.timestamp(_signed(value))
+            elif number == 3:
+                attrib['changeset'] = str(_signed(value))
+            elif number == 4:
+                attrib['uid'] = str(_signed(value))
+            elif number == 5:
+                attrib['user'] = strings[value]
+
+    def tags(self, keys, vals):
+        strings = self.strings
+        return [(strings[k], strings[v]) for k, v in zip(keys, vals)]
+
+    def node(self, span):
+        buf = self.buf
+        attrib = {}
+        keys = vals = ()
+        for number, value in _fields(buf, *span):
+            if number == 1:
+                attrib['id'] = str(_zigzag(value))
+            elif number == 2:
+                keys = _packed(buf, value)
+            elif number == 3:
+                vals = _packed(buf, value)
+            elif number == 4:
+                self.info(attrib, value)
+            elif number == 8:
+                attrib['lat'] = self.lat(_zigzag(value))
+            elif number == 9:
+                attrib['lon'] = self.lon(_zigzag(value))
+        return ('node', attrib, self.tags(keys, vals), None)
+
+    def dense_nodes(self, span):
+        buf = self.buf
+        strings = self.strings
+        ids = lats = lons = keys_vals = ()
+        info = {}
+        for number, value in _fields(buf, *span):
+            if number == 1:
+                ids = _unpack_deltas(buf, value)
+            elif number == 5:
+                for n, v in _fields(buf, *value):
+                    info[n] = v
+            elif number == 8:
+                lats = _unpack_deltas(buf, value)
+            elif number == 9:
+                lons = _unpack_deltas(buf, value)
+            elif number == 10:
+                keys_vals = _unpack_varints(buf, value)
+
+        versions = _unpack_varints(buf, info[1]) if 1 in info else None
+        timestamps = _unpack_deltas(buf, info[2]) if 2 in info else None
+        changesets = _unpack_deltas(buf, info[3]) if 3 in info else None
+        uids = _unpack_deltas(buf, info[4]) if 4 in info else None
+        user_sids = _unpack_deltas(buf, info[5]) if 5 in info else None
+
+        nodes = []
+        kv = 0
+        for i, node_id in enumerate(ids):
+            attrib = {'id': str(node_id), 'lat': self.lat(lats[i]), 'lon': self.lon(lons[i])}
+            if versions is not None:
+                attrib['version'] = str(_signed(versions[i]))
+            if timestamps is not None:
+                attrib['timestamp'] = self.timestamp(timestamps[i])
+            if changesets is not None:
+                attrib['changeset'] = str(changesets[i])
+            if uids is not None:
+                attrib['uid'] = str(uids[i])
+            if user_sids is not None:
+                attrib['user'] = strings[user_sids[i]]
+            tags = []
+            if keys_vals:
+                while keys_vals[kv] != 0:
+                    tags.append((strings[keys_vals[kv]], strings[keys_vals[kv + 1]]))
+                    kv += 2
+                kv += 1
+            nodes.append(('node', attrib, tags, None))
+        return nodes
+
+    def way(self, span):
+        buf = self.buf
+        attrib = {}
+        keys = vals = refs = ()
+        for number, value in _fields(buf, *span):
+            if number == 1:
+                attrib['id'] = str(_signed(value))
+            elif number == 2:
+                keys = _packed(buf, value)
+            elif number == 3:
+                vals = _packed(buf, value)
+            elif number == 4:
+                self.info(attrib, value)
+            elif number == 8:
+                refs = _packed_deltas(buf, value)
+        return ('way', attrib, self.tags(keys, vals), [str(ref) for ref in refs])
+
+    def relation(self, span):
+        buf = self.buf
+        strings = self.strings
+        attrib = {}
+        keys = vals = roles = memids = types = ()
+        for number, value in _fields(buf, *span):
+            if number == 1:
+                attrib['id'] = str(_signed(value))
+            elif number == 2:
+                keys = _packed(buf, value)
+            elif number == 3:
+                vals = _packed(buf, value)
+            elif number == 4:
+                self.info(attrib, value)
+            elif number == 8:
+                roles = _packed(buf, value)
+            elif number == 9:
+                memids = _packed_deltas(buf, value)
+            elif number == 10:
+                types = _packed(buf, value)
+        members = [(MEMBER_TYPES[t], str(ref), strings[role])
+                   for t, ref, role in zip(types, memids, roles)]
+        return ('relation', attrib, self.tags(keys, vals), members)
+
+    def primitives(self, kinds=None):
+        """The decoded elements as (tag, attrib, tags, refs or members)"""
+        out = []
+        want_nodes = kinds is None or 'node' in kinds
+        for group in self.groups:
+            for number, value in _fields(self.buf, *group):
+                if number == 1 and want_nodes:
+                    out.append(self.node(value))
+                elif number == 2 and want_nodes:
+                    out.extend(self.dense_nodes(value))
+                elif number == 3 and (kinds is None or 'way' in kinds):
+                    out.append(self.way(value))
+                elif number == 4 and (kinds is None or 'relation' in kinds):
+                    out.append(self.relation(value))
+        return out
+
+
+def _blob_data(data):
+    """Uncompressed content of a Blob message"""
+    buf = bytearray(data)
+    for number, value in _fields(buf, 0, len(buf)):
+        if number == 2:
+            # raw_size
+            continue
+        payload = data[value[0]:value[1]]
+        if number == 1:
+            return payload
+        if number == 3:
+            return zlib.decompress(payload)
+        if number == 7:
+            try:
+                import zstandard
+            except ImportError:
+                raise ImportError("zstd compressed PBF blobs require the zstandard package")
+            return zstandard.ZstdDecompressor().decompress(payload)
+        raise ValueError("unsupported PBF blob compression (field {0})".format(number))
+    return ''
+
+
+def decode_block(data, kinds=None):
+    """Primitives of a compressed OSMData blob (picklable, for the pool)"""
+    return _Block(bytearray(_blob_data(data))).primitives(kinds)
+
+
+def _decode_task(args):
+    path, offset, size, kinds = args
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return decode_block(f.read(size), kinds)
+
+
+def to_element(primitive):
+    """ET.Element of a decoded primitive"""
+    tag, attrib, tags, children = primitive
+    element = ET.Element(tag, attrib)
+    if tag == 'way':
+        for ref in children:
+            ET.SubElement(element, 'nd', {'ref': ref})
+    elif tag == 'relation':
+        for member_type, ref, role in children:
+            ET.SubElement(element, 'member', {'type': member_type, 'ref': ref, 'role': role})
+    for k, v in tags:
+        ET.SubElement(element, 'tag', {'k': k, 'v': v})
+    return element
+
+
+# =====================================
+# File
+# =====================================
+
+def read_blobs(path):
+    """Yield (type, offset, size) of the blobs of a PBF file"""
+    with open(path, 'rb') as f:
+        while True:
+            head = f.read(4)
+            if len(head) < 4:
+                return
+            header_size = _BLOB_HEADER_SIZE.unpack(head)[0]
+            header = f.read(header_size)
+            buf = bytearray(header)
+            blob_type = None
+            size = 0
+            for number, value in _fields(buf, 0, len(buf)):
+                if number == 1:
+                    blob_type = header[value[0]:value[1]]
+                elif number == 3:
+                    size = value
+            offset = f.tell()
+            yield blob_type, offset, size
+            f.seek(offset + size)
+
+
+def read_header(data):
+    """(required features, bbox in nanodegrees or None, writing program) of an
+    OSMHeader blob"""
+    raw = _blob_data(data)
+    buf = bytearray(raw)
+    features = []
+    bbox = None
+    program = None
+    for number, value in _fields(buf, 0, len(buf)):
+        if number == 1:
+            box = dict((n, _zigzag(v)) for n, v in _fields(buf, *value))
+            # left, right, top, bottom
+            bbox = (box.get(4), box.get(1), box.get(3), box.get(2))
+        elif number == 4:
+            features.append(raw[value[0]:value[1]])
+        elif number == 16:
+            program = raw[value[0]:value[1]]
+    return features, bbox, program
+
+
+class PBFStream(object):
+    """Iterate over the elements of an OSM PBF file, like ElementStream
+
+    `root` is an <osm> element; the bounding box of the header is yielded as
+    a <bounds> element when all tags are requested. `position` is the number
+    of bytes of the file consumed so far.
+    """
+
+    def __init__(self, path, tags=TOP_LEVEL_TAGS, workers=1):
+        self.path = path
+        self.tags = tags
+        self.workers = workers
+        self.root = None
+        self.position = 0
+
+    def _blocks(self, blobs):
+        """Decoded primitives of the OSMData blobs, with their end offset"""
+        kinds = self.tags
+        if self.workers <= 1:
+            with open(self.path, 'rb') as f:
+                for offset, size in blobs:
+                    f.seek(offset)
+                    yield offset + size, decode_block(f.read(size), kinds)
+            return
+        pool = multiprocessing.Pool(self.workers)
+        try:
+            pending = deque()
+            blobs = iter(blobs)
+            for offset, size in blobs:
+                pending.append((offset + size, pool.apply_async(
+                    _decode_task, ((self.path, offset, size, kinds),))))
+                if len(pending) >= self.workers * AHEAD_PER_WORKER:
+                    end, result = pending.popleft()
+                    yield end, result.get()
+            while pending:
+                end, result = pending.popleft()
+                yield end, result.get()
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    def __iter__(self):
+        tags = self.tags
+        self.root = ET.Element('osm', {'version': '0.6'})
+        data_blobs = []
+        for blob_type, offset, size in read_blobs(self.path):
+            if blob_type == 'OSMHeader':
+                with open(self.path, 'rb') as f:
+                    f.seek(offset)
+                    features, bbox, program = read_header(f.read(size))
+                unsupported = set(features) - SUPPORTED_FEATURES
+                if unsupported:
+                    raise ValueError("unsupported PBF features: {0}".format(
+                        ', '.join(sorted(unsupported))))
+                if program:
+                    self.root.set('generator', program)
+                if bbox is not None and tags is None:
+                    yield ET.Element('bounds', dict(zip(
+                        ('minlat', 'minlon', 'maxlat', 'maxlon'),
+                        (_coordinate(c) for c in bbox))))
+            elif blob_type == 'OSMData':
+                data_blobs.append((offset, size))
+
+        for end, primitives in self._blocks(data_blobs):
+            self.position = end
+            for primitive in primitives:
+                yield to_element(primitive)
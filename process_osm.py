@@ -0,0 +1,513 @@
+# coding: utf-8
+
+# =====================================
+# Preparing CSV files for SQL Database
+# =====================================
+
+import json
+import multiprocessing
+import operator
+import os
+import pickle
+import pprint
+import re
+import shutil
+import time
+import xml.etree.cElementTree as ET
+import schema
+
+from checkpoint import Checkpoint, reopen_output
+from cleaning import CLEANERS
+from csv_output import CHUNK_SIZE, CSVWriter, open_output, output_path
+from fast_validator import FastValidator
+from osm_shards import ShardReader, split_osm
+from osm_stream import element_stream, get_element, is_pbf
+from profiling import Profile
+
+# Pathes to save the CSV files
+NODES_PATH = "nodes.csv"
+NODE_TAGS_PATH = "nodes_tags.csv"
+WAYS_PATH = "ways.csv"
+WAY_NODES_PATH = "ways_nodes.csv"
+WAY_TAGS_PATH = "ways_tags.csv"
+RELATIONS_PATH = "relations.csv"
+RELATION_MEMBERS_PATH = "relations_members.csv"
+RELATION_TAGS_PATH = "relations_tags.csv"
+
+# Regular expression to find tags with a colon in their names (lower_colon)
+# or tags with problematic characters (problemchars).    
+LOWER_COLON = re.compile(r'^([a-z]|_)+:([a-z]|_)+')
+PROBLEMCHARS = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
+
+class KeyClassifier(object):
+    """Split tag keys into (type, key), or None for problematic keys
+
+    Keys with a colon are split at the first colon ("addr:street" ->
+    ("addr", "street")), other keys get the default type. There are only a
+    few hundred distinct keys, so each verdict is computed once and looked
+    up afterwards (at most maxsize keys are remembered).
+    """
+
+    def __init__(self, lower_colon=LOWER_COLON, problem_chars=PROBLEMCHARS,
+                 default_tag_type='regular', maxsize=100000):
+        self.lower_colon = lower_colon
+        self.problem_chars = problem_chars
+        self.default_tag_type = default_tag_type
+        self.maxsize = maxsize
+        self.table = {}
+
+    def classify(self, k):
+        if self.problem_chars.match(k) is not None:
+            return None
+        if self.lower_colon.match(k) is not None:
+            tag_type, key = k.split(':', 1)
+            return (tag_type, key)
+        return (self.default_tag_type, k)
+
+    def __call__(self, k):
+        try:
+            return self.table[k]
+        except KeyError:
+            result = self.classify(k)
+            if len(self.table) < self.maxsize:
+                self.table[k] = result
+            return result
+
+# Tags whose key has problematic characters are left out of the shaped element
+classify_key = KeyClassifier()
+
+# The Udacity pre-defined schema to transform each element into the correct format. 
+SCHEMA = schema.schema
+
+# the fields order in the csvs matches the column order in the sql table schema
+NODE_FIELDS = ['id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset', 'timestamp']
+NODE_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
+WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+WAY_NODES_FIELDS = ['id', 'node_id', 'position']
+RELATION_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
+RELATION_MEMBERS_FIELDS = ['id', 'member_id', 'member_type', 'role', 'position']
+RELATION_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+
+# Getters returning the attributes of a node, way or relation in column order
+NODE_GETTER = operator.itemgetter(*NODE_FIELDS)
+WAY_GETTER = operator.itemgetter(*WAY_FIELDS)
+RELATION_GETTER = operator.itemgetter(*RELATION_FIELDS)
+
+# Attribute fields of each element type
+ELEMENT_FIELDS = {'node': NODE_FIELDS, 'way': WAY_FIELDS, 'relation': RELATION_FIELDS}
+
+# Schema fields of the rows of each element type, in the order of
+# ShapedElement.rows()
+ROW_LAYOUTS = {
+    'node': (('node', NODE_FIELDS), ('node_tags', NODE_TAGS_FIELDS)),
+    'way': (('way', WAY_FIELDS), ('way_nodes', WAY_NODES_FIELDS), ('way_tags', WAY_TAGS_FIELDS)),
+    'relation': (('relation', RELATION_FIELDS), ('relation_members', RELATION_MEMBERS_FIELDS),
+                 ('relation_tags', RELATION_TAGS_FIELDS)),
+}
+
+class ShapedElement(object):
+    """A shaped node, way or relation: rows as tuples in csv/sql column order
+
+    `attribs` is the row of the nodes, ways or relations table, `tags` the
+    rows of its tags table, `way_nodes` (ways only) the rows of ways_nodes
+    and `members` (relations only) the rows of relations_members.
+    """
+
+    __slots__ = ('tag', 'attribs', 'tags', 'way_nodes', 'members')
+
+    def __init__(self, tag, attribs, tags, way_nodes=None, members=None):
+        self.tag = tag
+        self.attribs = attribs
+        self.tags = tags
+        self.way_nodes = way_nodes
+        self.members = members
+
+    @property
+    def fields(self):
+        return ELEMENT_FIELDS[self.tag]
+
+    def get(self, field):
+        """Value of one attribute of the element"""
+        return self.attribs[self.fields.index(field)]
+
+    def rows(self):
+        """The rows of the element in the order of ROW_LAYOUTS"""
+        if self.tag == 'node':
+            return (self.attribs, self.tags)
+        if self.tag == 'relation':
+            return (self.attribs, self.members, self.tags)
+        return (self.attribs, self.way_nodes, self.tags)
+
+    def as_dict(self):
+        """The element in the dict format of schema.py"""
+        if self.tag == 'node':
+            return {'node': dict(zip(NODE_FIELDS, self.attribs)),
+                    'node_tags': [dict(zip(NODE_TAGS_FIELDS, row)) for row in self.tags]}
+        if self.tag == 'relation':
+            return {'relation': dict(zip(RELATION_FIELDS, self.attribs)),
+                    'relation_members': [dict(zip(RELATION_MEMBERS_FIELDS, row))
+                                         for row in self.members],
+                    'relation_tags': [dict(zip(RELATION_TAGS_FIELDS, row)) for row in self.tags]}
+        return {'way': dict(zip(WAY_FIELDS, self.attribs)),
+                'way_nodes': [dict(zip(WAY_NODES_FIELDS, row)) for row in self.way_nodes],
+                'way_tags': [dict(zip(WAY_TAGS_FIELDS, row)) for row in self.tags]}
+
+# Handle secondary tags the same way for node, way and relation elements
+def shape_tags(element_id, element):
+    """Rows (id, key, value, type) of the cleaned tags of an element"""
+    tags = []
+    for tag in element.iter("tag"):
+        k = tag.attrib['k']
+        key_split = classify_key(k)
+        if key_split is None:
+            continue
+        value = tag.attrib['v']
+        cleaner = CLEANERS.get(k)
+        if cleaner is not None:
+            value = cleaner(value)
+        tags.append((element_id, key_split[1], value, key_split[0]))
+    return tags
+
+def shape_record(element):
+    """Clean and shape node, way or relation XML element to a ShapedElement"""
+    attrib = element.attrib
+    if element.tag == 'node':
+        return ShapedElement('node', NODE_GETTER(attrib), shape_tags(attrib['id'], element))
+    elif element.tag == 'way':
+        way_id = attrib['id']
+        way_nodes = [(way_id, nd.attrib['ref'], position)
+                     for position, nd in enumerate(element.iter("nd"))]
+        return ShapedElement('way', WAY_GETTER(attrib), shape_tags(way_id, element), way_nodes)
+    elif element.tag == 'relation':
+        relation_id = attrib['id']
+        members = [(relation_id, member.attrib['ref'], member.attrib['type'],
+                    member.attrib['role'], position)
+                   for position, member in enumerate(element.iter("member"))]
+        return ShapedElement('relation', RELATION_GETTER(attrib),
+                             shape_tags(relation_id, element), members=members)
+
+# The shape_element function will transform each element into the correct format. 
+# using schema.py file and checks the format using the cerberus library 
+# and their respective values using update functions.
+def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIELDS,
+                  problem_chars=PROBLEMCHARS, default_tag_type='regular'):
+    """Clean and shape node, way or relation XML element to Python dict"""
+    record = shape_record(element)
+    if record is not None:
+        return record.as_dict()
+
+class ValidationError(Exception):
+    """An element does not match the schema; `errors` holds the cerberus
+    errors of all its fields"""
+
+def validate_element(element, validator, schema=SCHEMA):
+    """Raise ValidationError if element does not match schema"""
+    if validator.validate(element, schema) is not True:
+        field, errors = next(validator.errors.iteritems())
+        message_string = "\nElement of type '{0}' has the following errors:\n{1}"
+        error_string = pprint.pformat(errors)
+        
+        error = ValidationError(message_string.format(field, error_string))
+        error.errors = validator.errors
+        raise error
+
+def validate_record(record, validator, schema=SCHEMA):
+    """Raise ValidationError if a ShapedElement does not match schema
+
+    The tuple rows are checked by the FastValidator; the dict of the element
+    is only built for validate_element when they do not pass.
+    """
+    if not validator.check_rows(record.rows(), ROW_LAYOUTS[record.tag], schema):
+        validate_element(record.as_dict(), validator, schema)
+
+CSV_PATHS = [NODES_PATH, NODE_TAGS_PATH, WAYS_PATH, WAY_NODES_PATH, WAY_TAGS_PATH,
+             RELATIONS_PATH, RELATION_MEMBERS_PATH, RELATION_TAGS_PATH]
+CSV_FIELDS = [NODE_FIELDS, NODE_TAGS_FIELDS, WAY_FIELDS, WAY_NODES_FIELDS, WAY_TAGS_FIELDS,
+              RELATION_FIELDS, RELATION_MEMBERS_FIELDS, RELATION_TAGS_FIELDS]
+
+# Elements shaped into the csv files
+ELEMENT_TAGS = ('node', 'way', 'relation')
+
+# Errors of shape_record (missing attribute) and validate_element which send
+# an element to the quarantine
+QUARANTINED_ERRORS = (KeyError, ValidationError)
+
+# Input processed between two checkpoints in single process mode
+CHECKPOINT_BYTES = 64 << 20
+
+class QuarantineWriter(object):
+    """Writes the elements which cannot be shaped or validated as JSON lines:
+    {"type": ..., "attrib": {...}, "children": [[tag, {...}], ...],
+    "errors": {...}} where errors are the cerberus errors of the element (or
+    {"shape": [message]})"""
+
+    def __init__(self, f):
+        self.f = f
+        self.rows_written = 0
+
+    def add(self, element, error):
+        if isinstance(error, ValidationError):
+            errors = error.errors
+        elif isinstance(error, KeyError):
+            errors = {'shape': ['missing attribute {0!r}'.format(error.args[0])]}
+        else:
+            errors = {'shape': [str(error)]}
+        self.f.write(json.dumps({'type': element.tag,
+                                 'attrib': dict(element.attrib),
+                                 'children': [[child.tag, dict(child.attrib)] for child in element],
+                                 'errors': errors}, sort_keys=True, default=str) + '\n')
+        self.rows_written += 1
+
+    def flush(self):
+        pass
+
+class ShardError(Exception):
+    """An error of a worker process which could not be sent back as it was"""
+
+def write_elements(elements, writers, validate, profile=None, quarantine=None):
+    """Shape, optionally validate and write elements with the eight csv writers
+
+    With a QuarantineWriter, the elements which cannot be shaped or validated
+    are written to it instead of raising the error. With a profiling.Profile,
+    the parse, shape, validate and write stages are timed.
+    """
+
+    (nodes_writer, node_tags_writer, ways_writer, way_nodes_writer, way_tags_writer,
+     relations_writer, relation_members_writer, relation_tags_writer) = writers
+
+    validator = FastValidator()
+
+    def check(record):
+        validate_record(record, validator)
+
+    def write(record):
+        if record.tag == 'node':
+            nodes_writer.writerow(record.attribs)
+            node_tags_writer.writerows(record.tags)
+        elif record.tag == 'way':
+            ways_writer.writerow(record.attribs)
+            way_nodes_writer.writerows(record.way_nodes)
+            way_tags_writer.writerows(record.tags)
+        else:
+            relations_writer.writerow(record.attribs)
+            relation_members_writer.writerows(record.members)
+            relation_tags_writer.writerows(record.tags)
+
+    def flush():
+        for writer in writers:
+            writer.flush()
+
+    shape = shape_record
+    if profile is not None:
+        shape = profile.timed('shape', shape)
+        if validate is True:
+            check = profile.timed('validate', check)
+        write = profile.timed('write', write)
+        flush = profile.timed('write', flush, count=False)
+
+    if quarantine is None:
+        for element in elements:
+            record = shape(element)
+            if record:
+                if validate is True:
+                    check(record)
+                write(record)
+    else:
+        for element in elements:
+            try:
+                record = shape(element)
+                if record and validate is True:
+                    check(record)
+            except QUARANTINED_ERRORS as error:
+                quarantine.add(element, error)
+                continue
+            if record:
+                write(record)
+
+    flush()
+    if profile is not None:
+        profile.add_bytes('write', sum(writer.bytes_written for writer in writers))
+
+def _write_shard(file_in, index, start, end, validate, profile_options, quarantine):
+    part_paths = ['{0}.part{1:05d}'.format(path, index) for path in CSV_PATHS]
+    if quarantine is not None:
+        part_paths.append('{0}.part{1:05d}'.format(quarantine, index))
+    part_files = [open(path, 'wb') for path in part_paths]
+    profile = None
+    if profile_options is not None:
+        profile = Profile(label='shard {0}'.format(index), **profile_options)
+        profile.total_bytes = end - start
+        profile.start()
+    try:
+        writers = [CSVWriter(f, fields) for f, fields in zip(part_files, CSV_FIELDS)]
+        quarantined = QuarantineWriter(part_files[-1]) if quarantine is not None else None
+        with ShardReader(file_in, start, end) as shard:
+            elements = get_element(shard, tags=ELEMENT_TAGS)
+            if profile is not None:
+                elements = profile.iter('parse', elements,
+                                        lambda: end - start - shard.remaining)
+            write_elements(elements, writers, validate, profile, quarantined)
+    finally:
+        for f in part_files:
+            f.close()
+    rows = [writer.rows_written for writer in writers]
+    if quarantined is not None:
+        rows.append(quarantined.rows_written)
+    if profile is None:
+        return part_paths, rows, None
+    profile.stop()
+    return part_paths, rows, profile.report()
+
+def _process_shard(args):
+    """Process one byte range of the OSM file into its own part csv(s) (and
+    quarantine part)
+
+    Returns the part paths, their numbers of rows and the report of the
+    shard's profile (or None). Errors which cannot be pickled back to the
+    parent process (such as the ParseError of cElementTree) are raised as
+    ShardError.
+    """
+    file_in, index, start, end = args[:4]
+    try:
+        return _write_shard(*args)
+    except Exception as error:
+        try:
+            pickle.dumps(error)
+        except Exception:
+            raise ShardError('shard {0} (bytes {1}-{2} of {3}): {4}: {5}'.format(
+                index, start, end, file_in, type(error).__name__, error))
+        raise
+
+def process_map(file_in, validate, workers=1, shards=None, compression=None, profile=None,
+                quarantine=None, checkpoint=None):
+    """Iteratively process each XML element and write to csv(s)
+
+    With workers > 1 the file is split into byte ranges (by default 4 per
+    worker) which are shaped and validated in a process pool; the per-shard
+    csv parts are appended to the output files in file order, so the result
+    is the same as in the single process mode.
+
+    PBF files (.osm.pbf) are written by a single process, their blocks being
+    decoded by the `workers` processes.
+
+    compression ('gzip' or 'zstd') writes compressed nodes.csv.gz, ... files.
+
+    profile (a profiling.Profile) collects the time spent in each stage; the
+    stages of the worker processes are added up.
+
+    quarantine (a path) writes the elements which cannot be shaped or fail
+    the validation to that file (see QuarantineWriter) and goes on, instead
+    of aborting the run.
+
+    checkpoint (a path) saves the progress after every CHECKPOINT_BYTES of
+    the input (every shard with workers > 1), so that the same call resumes
+    from there after a crash or an interruption (see checkpoint.py); it
+    requires an XML input and uncompressed outputs.
+
+    Returns the number of quarantined elements.
+    """
+    if checkpoint is not None and (compression is not None or is_pbf(file_in)):
+        raise ValueError("checkpoints require an XML input and uncompressed outputs")
+
+    if profile is not None:
+        profile.info.update([('input', file_in), ('input_bytes', os.path.getsize(file_in)),
+                             ('workers', workers), ('validate', validate is True)])
+        profile.total_bytes = os.path.getsize(file_in)
+        profile.start()
+    paths = [output_path(path, compression) for path in CSV_PATHS]
+    if quarantine is not None:
+        paths.append(quarantine)
+    progress = state = None
+    if checkpoint is not None:
+        progress = Checkpoint(checkpoint, file_in, {'validate': validate is True,
+                                                    'outputs': paths})
+        state = progress.load()
+    if state is not None:
+        files = [reopen_output(path, state['outputs'][path][0]) for path in paths]
+        offset = state['offset']
+    else:
+        files = [open_output(path, compression) for path in paths[:len(CSV_PATHS)]]
+        if quarantine is not None:
+            files.append(open(quarantine, 'wb'))
+        offset = 0
+    try:
+        writers = [CSVWriter(f, fields) for f, fields in zip(files, CSV_FIELDS)]
+        quarantined = QuarantineWriter(files[-1]) if quarantine is not None else None
+        outputs = writers + [quarantined] if quarantined is not None else writers
+        if state is None:
+            for writer in writers:
+                writer.writeheader()
+        else:
+            for writer, path in zip(outputs, paths):
+                writer.rows_written = state['outputs'][path][1]
+
+        def save(offset):
+            for writer in outputs:
+                writer.flush()
+            for f in files:
+                f.flush()
+            progress.save(offset, dict((path, (f.tell(), writer.rows_written))
+                                       for path, f, writer in zip(paths, files, outputs)))
+
+        if progress is None and (workers <= 1 or is_pbf(file_in)):
+            with open(file_in, 'rb') as osm_file:
+                stream = element_stream(osm_file, tags=ELEMENT_TAGS, workers=workers)
+                elements = iter(stream)
+                if profile is not None:
+                    elements = profile.iter('parse', elements, lambda: stream.position)
+                write_elements(elements, writers, validate, profile, quarantined)
+        elif workers <= 1:
+            size = os.path.getsize(file_in)
+            for start, end in split_osm(file_in, -(-(size - offset) // CHECKPOINT_BYTES), offset):
+                with ShardReader(file_in, start, end) as shard:
+                    elements = get_element(shard, tags=ELEMENT_TAGS)
+                    if profile is not None:
+                        elements = profile.iter('parse', elements,
+                                                lambda: end - shard.remaining)
+                    write_elements(elements, writers, validate, profile, quarantined)
+                save(end)
+        else:
+            for writer in writers:
+                writer.flush()
+            ranges = split_osm(file_in, shards or workers * 4, offset)
+            profile_options = profile.options() if profile is not None else None
+            tasks = [(file_in, i, start, end, validate, profile_options, quarantine)
+                     for i, (start, end) in enumerate(ranges)]
+            merge = profile.stage('merge') if profile is not None else None
+            pool = multiprocessing.Pool(workers)
+            try:
+                results = pool.imap(_process_shard, tasks)
+                for (part_paths, rows, report), (start, end) in zip(results, ranges):
+                    started = time.time()
+                    for f, part_path in zip(files, part_paths):
+                        if merge is not None:
+                            merge.bytes += os.path.getsize(part_path)
+                        with open(part_path, 'rb') as part:
+                            shutil.copyfileobj(part, f, CHUNK_SIZE)
+                        os.remove(part_path)
+                    for writer, n in zip(outputs, rows):
+                        writer.rows_written += n
+                    if progress is not None:
+                        save(end)
+                    if profile is not None:
+                        merge.wall += time.time() - started
+                        merge.elements += 1
+                        profile.merge(report)
+                        if profile.progress_interval:
+                            profile.log('{0} of {1} shards done'.format(merge.elements,
+                                                                        len(tasks)))
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        if progress is not None:
+            progress.clear()
+        return quarantined.rows_written if quarantined is not None else 0
+    finally:
+        for f in files:
+            f.close()
+        if profile is not None:
+            profile.stop()
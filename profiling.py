@@ -0,0 +1,272 @@
+# coding: utf-8
+
+# =====================================
+# Stage-level profiling of the pipeline
+# =====================================
+#
+# A Profile passed to process_map or load_osm times each stage of the
+# pipeline: parse (reading the XML or PBF input), shape (shape_record),
+# validate, write (CSV output) or insert (SQLite), plus merge of the shard
+# parts in parallel mode. For each stage it reports the number of elements, the
+# bytes read or written, the cumulative wall and CPU time, the rates and the
+# peak RSS, as JSON so that runs can be compared:
+#
+#   profile = Profile(progress_interval=10)
+#   process_map('boston_massachusetts.osm', validate=True, profile=profile)
+#   profile.dump('profile.json')
+#
+# or from the command line:
+#
+#   python profiling.py boston_massachusetts.osm [workers] [profile.json]
+#
+# While the file is parsed a progress line is written to stderr every
+# progress_interval seconds. Timing every call costs about 2 us per element
+# and stage; without a profile nothing is timed.
+#
+# sampler hooks a sampling profiler into the run: StackSampler (a small
+# SIGPROF based sampler counting the executing functions) or any object with
+# start(), stop() and report() methods (other samplers only run in the main
+# process, StackSampler is also run in the worker processes).
+
+import json
+import os
+import resource
+import signal
+import sys
+import time
+from collections import Counter, OrderedDict
+
+# Elements between two checks of the progress clock
+PROGRESS_CHECK = 1000
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except IOError:
+        pass
+    # ru_maxrss is in KB on Linux, bytes on OS X
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024.0 * 1024.0) if sys.platform == 'darwin' else rss / 1024.0
+
+
+class StageStats(object):
+    """Counters of one stage"""
+
+    __slots__ = ('elements', 'bytes', 'wall', 'cpu', 'peak_rss_mb')
+
+    def __init__(self):
+        self.elements = 0
+        self.bytes = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak_rss_mb = 0.0
+
+    def as_dict(self):
+        return OrderedDict([
+            ('elements', self.elements),
+            ('bytes', self.bytes),
+            ('wall_seconds', round(self.wall, 6)),
+            ('cpu_seconds', round(self.cpu, 6)),
+            ('elements_per_second', round(self.elements / self.wall, 1) if self.wall else None),
+            ('bytes_per_second', round(self.bytes / self.wall, 1) if self.wall else None),
+            ('peak_rss_mb', round(self.peak_rss_mb, 1)),
+        ])
+
+    def merge(self, stats):
+        """Add the counters of a report (as_dict) of another process"""
+        self.elements += stats['elements']
+        self.bytes += stats['bytes']
+        self.wall += stats['wall_seconds']
+        self.cpu += stats['cpu_seconds']
+        self.peak_rss_mb = max(self.peak_rss_mb, stats['peak_rss_mb'])
+
+
+class StackSampler(object):
+    """Counts the function executing every `interval` seconds of CPU time
+    (SIGPROF); only usable from the main thread"""
+
+    def __init__(self, interval=0.005, top=30):
+        self.interval = interval
+        self.top = top
+        self.samples = Counter()
+
+    def _sample(self, signum, frame):
+        if frame is not None:
+            code = frame.f_code
+            self.samples['{0}:{1}({2})'.format(
+                os.path.basename(code.co_filename), code.co_firstlineno, code.co_name)] += 1
+
+    def start(self):
+        self.previous = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self.previous)
+
+    def report(self):
+        return OrderedDict(self.samples.most_common(self.top))
+
+    def merge(self, report):
+        self.samples.update(report)
+
+
+class Profile(object):
+    """Per-stage counters of a pipeline run"""
+
+    def __init__(self, progress_interval=None, sampler=None, label=None, stream=sys.stderr):
+        self.progress_interval = progress_interval
+        self.sampler = sampler
+        self.label = label
+        self.stream = stream
+        self.stages = OrderedDict()
+        self.info = OrderedDict()
+        self.total_bytes = None
+        self.started = None
+        self.wall = self.cpu = 0.0
+
+    def options(self):
+        """Arguments recreating an equivalent (empty) profile, e.g. in the
+        worker processes"""
+        sampler = None
+        if isinstance(self.sampler, StackSampler):
+            sampler = StackSampler(self.sampler.interval, self.sampler.top)
+        return {'progress_interval': self.progress_interval, 'sampler': sampler}
+
+    def stage(self, name):
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = StageStats()
+        return stats
+
+    def start(self):
+        self.started = time.time()
+        self._wall_start = time.time()
+        self._cpu_start = time.clock()
+        if self.sampler is not None:
+            self.sampler.start()
+
+    def stop(self):
+        if self.sampler is not None:
+            self.sampler.stop()
+        self.wall += time.time() - self._wall_start
+        self.cpu += time.clock() - self._cpu_start
+        rss = peak_rss_mb()
+        for stats in self.stages.values():
+            stats.peak_rss_mb = max(stats.peak_rss_mb, rss)
+
+    def timed(self, name, func, count=True):
+        """func, timed in the stage `name` (and its calls counted as elements
+        of the stage unless count is False)"""
+        stats = self.stage(name)
+        clock = time.clock
+        now = time.time
+        increment = 1 if count else 0
+
+        def timed_call(*args):
+            wall = now()
+            cpu = clock()
+            result = func(*args)
+            stats.cpu += clock() - cpu
+            stats.wall += now() - wall
+            stats.elements += increment
+            return result
+        return timed_call
+
+    def iter(self, name, elements, position=None):
+        """Time the production of the elements (e.g. the XML parsing);
+        position() returns the bytes read so far, for the rates and the
+        progress lines"""
+        return self._iter(self.stage(name), name, elements, position)
+
+    def _iter(self, stats, name, elements, position):
+        clock = time.clock
+        now = time.time
+        elements = iter(elements)
+        last_progress = now()
+        while True:
+            wall = now()
+            cpu = clock()
+            try:
+                element = next(elements)
+            except StopIteration:
+                break
+            finally:
+                stats.cpu += clock() - cpu
+                stats.wall += now() - wall
+            stats.elements += 1
+            if stats.elements % PROGRESS_CHECK == 0:
+                if position is not None:
+                    stats.bytes = position()
+                if self.progress_interval and now() - last_progress >= self.progress_interval:
+                    last_progress = now()
+                    stats.peak_rss_mb = max(stats.peak_rss_mb, peak_rss_mb())
+                    self.progress(name, stats)
+            yield element
+        if position is not None:
+            stats.bytes = position()
+
+    def log(self, message):
+        if self.label:
+            message = '[{0}] {1}'.format(self.label, message)
+        self.stream.write(message + '\n')
+        self.stream.flush()
+
+    def progress(self, name, stats):
+        elapsed = time.time() - self._wall_start
+        line = '{0}: {1} elements in {2:.0f} s ({3:.0f}/s), {4:.0f} MB'.format(
+            name, stats.elements, elapsed, stats.elements / elapsed if elapsed else 0,
+            stats.bytes / 1048576.0)
+        if self.total_bytes:
+            line += ' of {0:.0f} MB ({1:.1f}%)'.format(self.total_bytes / 1048576.0,
+                                                       100.0 * stats.bytes / self.total_bytes)
+        self.log(line + ', peak RSS {0:.0f} MB'.format(stats.peak_rss_mb))
+
+    def add_bytes(self, name, n):
+        self.stage(name).bytes += n
+
+    def merge(self, report):
+        """Add the stages of the report of a worker process"""
+        for name, stats in report['stages'].items():
+            self.stage(name).merge(stats)
+        if self.sampler is not None and report.get('samples'):
+            self.sampler.merge(report['samples'])
+
+    def report(self):
+        report = OrderedDict([
+            ('started', time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started))
+             if self.started else None),
+            ('wall_seconds', round(self.wall, 6)),
+            ('cpu_seconds', round(self.cpu, 6)),
+            ('peak_rss_mb', round(max([peak_rss_mb()] + [s.peak_rss_mb for s in
+                                                         self.stages.values()]), 1)),
+        ])
+        report.update(self.info)
+        report['stages'] = OrderedDict((name, stats.as_dict())
+                                       for name, stats in self.stages.items())
+        if self.sampler is not None:
+            report['samples'] = self.sampler.report()
+        return report
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+
+if __name__ == '__main__':
+    from process_osm import process_map
+
+    osm_file = sys.argv[1]
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    profile = Profile(progress_interval=10)
+    process_map(osm_file, validate=True, workers=workers, profile=profile)
+    if len(sys.argv) > 3:
+        profile.dump(sys.argv[3])
+    else:
+        json.dump(profile.report(), sys.stdout, indent=2)
+        print('')
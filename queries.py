@@ -0,0 +1,167 @@
+# coding: utf-8
+
+# =====================================
+# Analysis queries and their indexes
+# =====================================
+#
+# The named queries of P3_codes.py, the secondary indexes they rely on and a
+# small harness printing the query plans and timings of every query without
+# and with the indexes:
+#
+#   python queries.py boston_massachusetts.db
+
+import sqlite3
+import sys
+import time
+from collections import OrderedDict
+
+QUERIES = OrderedDict([
+    ('nodes', '''SELECT COUNT(*) FROM nodes;'''),
+    ('ways', '''SELECT COUNT(*) FROM ways;'''),
+    # The key filter is repeated in both branches of the UNION ALL so that
+    # each branch reads the matching tags from the index only
+    ('postcodes', '''SELECT tags.value, COUNT(*) as count
+FROM (SELECT value FROM nodes_tags WHERE key='postcode'
+      UNION ALL
+      SELECT value FROM ways_tags WHERE key='postcode') tags
+GROUP BY tags.value
+ORDER BY count DESC LIMIT 10;'''),
+    ('cities', '''SELECT tags.value, COUNT(*) as count
+FROM (SELECT value FROM nodes_tags WHERE key LIKE '%city'
+      UNION ALL
+      SELECT value FROM ways_tags WHERE key LIKE '%city') tags
+GROUP BY tags.value
+ORDER BY count DESC
+LIMIT 10;'''),
+    ('unique_users', '''SELECT COUNT(DISTINCT(e.uid))
+FROM (SELECT uid FROM nodes UNION ALL SELECT uid FROM ways) e;'''),
+    ('top_users', '''SELECT e.user, COUNT(*) as num
+FROM (SELECT user FROM nodes UNION ALL SELECT user FROM ways) e
+GROUP BY e.user
+ORDER BY num DESC
+LIMIT 10;'''),
+    ('single_post_users', '''SELECT COUNT(*)
+FROM
+    (SELECT e.user, COUNT(*) as num
+     FROM (SELECT user FROM nodes UNION ALL SELECT user FROM ways) e
+     GROUP BY e.user
+     HAVING num=1)  u;'''),
+    ('amenities', '''SELECT value, COUNT(*) as num
+FROM nodes_tags
+WHERE key='amenity'
+GROUP BY value
+ORDER BY num DESC
+LIMIT 10;'''),
+    ('religion', '''SELECT nodes_tags.value, COUNT(*) as num
+FROM nodes_tags
+    JOIN (SELECT DISTINCT(id) FROM nodes_tags WHERE value='place_of_worship') i
+    ON nodes_tags.id=i.id
+WHERE nodes_tags.key='religion'
+GROUP BY nodes_tags.value
+ORDER BY num DESC
+LIMIT 1;'''),
+    ('cuisines', '''SELECT nodes_tags.value, COUNT(*) as num
+FROM nodes_tags
+    JOIN (SELECT DISTINCT(id) FROM nodes_tags WHERE value='restaurant') i
+    ON nodes_tags.id=i.id
+WHERE nodes_tags.key='cuisine'
+GROUP BY nodes_tags.value
+ORDER BY num DESC
+LIMIT 10;'''),
+    ('buildings', '''SELECT value, COUNT(*) as num
+FROM nodes_tags
+WHERE key='building'
+GROUP BY value
+ORDER BY num DESC;'''),
+])
+
+# Covering indexes for the key/value filters, the id joins, the node -> ways
+# lookups and the member -> relations lookups
+INDEXES = OrderedDict([
+    ('nodes_tags_key_value_id', 'nodes_tags(key, value, id)'),
+    ('nodes_tags_value_id', 'nodes_tags(value, id)'),
+    ('nodes_tags_id', 'nodes_tags(id)'),
+    ('ways_tags_key_value_id', 'ways_tags(key, value, id)'),
+    ('ways_tags_value_id', 'ways_tags(value, id)'),
+    ('ways_tags_id', 'ways_tags(id)'),
+    ('ways_nodes_id', 'ways_nodes(id, position)'),
+    ('ways_nodes_node_id', 'ways_nodes(node_id)'),
+    ('relations_tags_key_value_id', 'relations_tags(key, value, id)'),
+    ('relations_tags_id', 'relations_tags(id)'),
+    ('relations_members_id', 'relations_members(id, position)'),
+    ('relations_members_member', 'relations_members(member_type, member_id, id)'),
+])
+
+INDEX_SQL = ['CREATE INDEX IF NOT EXISTS {0} ON {1};'.format(name, columns)
+             for name, columns in INDEXES.items()] + ['ANALYZE;']
+
+
+def create_indexes(con):
+    """Create the indexes and refresh the query planner statistics
+
+    Indexes of tables missing from the database (e.g. the relation tables of
+    a database built before they were loaded) are skipped.
+    """
+    tables = set(row[0] for row in con.execute(
+        "SELECT name FROM sqlite_master WHERE type='table';"))
+    for name, columns in INDEXES.items():
+        if columns.split('(')[0] in tables:
+            con.execute('CREATE INDEX IF NOT EXISTS {0} ON {1};'.format(name, columns))
+    con.execute('ANALYZE;')
+    con.commit()
+
+
+def drop_indexes(con):
+    for name in INDEXES:
+        con.execute('DROP INDEX IF EXISTS {0};'.format(name))
+    con.commit()
+
+
+def explain(con, name):
+    """Return the lines of the query plan of a named query"""
+    return [row[-1] for row in con.execute('EXPLAIN QUERY PLAN ' + QUERIES[name])]
+
+
+def time_query(con, name, repeat=3):
+    """Best wall time (s) of a named query out of `repeat` runs"""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        con.execute(QUERIES[name]).fetchall()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def compare_indexing(db_path, names=None, repeat=3):
+    """Plan and time the named queries without, then with the indexes.
+
+    The database is left indexed. Returns {name: {'before': {...},
+    'after': {...}}} with the 'plan' and 'seconds' of each run.
+    """
+    names = names or QUERIES.keys()
+    con = sqlite3.connect(db_path)
+    con.text_factory = str
+    try:
+        report = OrderedDict((name, {}) for name in names)
+        drop_indexes(con)
+        for stage in ('before', 'after'):
+            if stage == 'after':
+                create_indexes(con)
+            for name in names:
+                report[name][stage] = {'plan': explain(con, name),
+                                       'seconds': time_query(con, name, repeat)}
+        return report
+    finally:
+        con.close()
+
+
+if __name__ == '__main__':
+    report = compare_indexing(sys.argv[1])
+    for name, stages in report.items():
+        print('{0}: {1:.4f} s -> {2:.4f} s'.format(
+            name, stages['before']['seconds'], stages['after']['seconds']))
+        for stage in ('before', 'after'):
+            for line in stages[stage]['plan']:
+                print('    {0:6s} {1}'.format(stage, line))
@@ -0,0 +1,161 @@
+# coding: utf-8
+
+# =====================================
+# Query service over the analysis database
+# =====================================
+#
+# QueryService runs the named queries of queries.py (or any SQL) for a
+# multi-threaded caller such as a web tier:
+#
+#   service = QueryService('boston_massachusetts.db')
+#   service.run('top_users')                   # cached list of rows
+#   pending = service.submit('cuisines')       # runs on a worker thread
+#   for row in service.stream('SELECT * FROM nodes_tags;'):   # fetchmany
+#       ...
+#   pending.get()
+#   service.close()
+#
+# The connections are read-only (PRAGMA query_only) and shared through a
+# pool; the cached results are dropped whenever the database file (or its
+# write-ahead log) is modified.
+
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+from Queue import Queue
+
+from queries import QUERIES
+
+# Number of rows fetched at once by stream
+STREAM_BATCH = 1000
+
+
+def open_read_only(db_path):
+    """A connection refusing writes, usable from any thread"""
+    if not os.path.exists(db_path):
+        raise IOError("no database at {0!r}".format(db_path))
+    con = sqlite3.connect(db_path, check_same_thread=False)
+    con.text_factory = str
+    con.execute('PRAGMA query_only=ON;')
+    return con
+
+
+class ConnectionPool(object):
+    """A fixed number of read-only connections, handed out one thread at a
+    time"""
+
+    def __init__(self, db_path, size=4):
+        self.connections = [open_read_only(db_path) for _ in range(size)]
+        self.idle = Queue()
+        for con in self.connections:
+            self.idle.put(con)
+
+    @contextmanager
+    def connection(self):
+        con = self.idle.get()
+        try:
+            yield con
+        finally:
+            self.idle.put(con)
+
+    def close(self):
+        for con in self.connections:
+            con.close()
+
+
+class QueryService(object):
+    """Pooled, cached and threaded execution of the analysis queries"""
+
+    def __init__(self, db_path, pool_size=4, workers=4, cache_size=256, queries=QUERIES):
+        self.db_path = db_path
+        self.queries = queries
+        self.pool = ConnectionPool(db_path, pool_size)
+        self.workers = ThreadPool(workers)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.signature = self.db_signature()
+
+    def db_signature(self):
+        """Size and modification time of the database and WAL files"""
+        signature = []
+        for path in (self.db_path, self.db_path + '-wal'):
+            try:
+                st = os.stat(path)
+            except OSError:
+                signature.append(None)
+            else:
+                signature.append((st.st_size, st.st_mtime))
+        return tuple(signature)
+
+    def sql(self, query):
+        """SQL of a named query, or the query itself"""
+        return self.queries.get(query, query)
+
+    def _check_signature(self):
+        signature = self.db_signature()
+        if signature != self.signature:
+            self.cache.clear()
+            self.signature = signature
+
+    def run(self, query, params=(), cache=True):
+        """All the rows of a query, from the cache when the database has not
+        changed since they were computed"""
+        sql = self.sql(query)
+        key = (sql, tuple(params))
+        if cache:
+            with self.lock:
+                self._check_signature()
+                if key in self.cache:
+                    return self.cache[key]
+        with self.pool.connection() as con:
+            rows = con.execute(sql, params).fetchall()
+        if cache:
+            with self.lock:
+                self.cache[key] = rows
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return rows
+
+    def submit(self, query, params=(), cache=True, callback=None):
+        """Run a query on a worker thread; returns an AsyncResult (.get())"""
+        return self.workers.apply_async(self.run, (query, params, cache), callback=callback)
+
+    def run_all(self, names=None):
+        """Run the named queries concurrently; returns {name: rows}"""
+        names = names or self.queries.keys()
+        pending = [(name, self.submit(name)) for name in names]
+        return OrderedDict((name, result.get()) for name, result in pending)
+
+    def stream(self, query, params=(), batch_size=STREAM_BATCH):
+        """Yield the rows of a query batch by batch (not cached); the
+        connection is held until the generator is exhausted or closed"""
+        with self.pool.connection() as con:
+            cursor = con.execute(self.sql(query), params)
+            try:
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield row
+            finally:
+                cursor.close()
+
+    def clear_cache(self):
+        with self.lock:
+            self.cache.clear()
+
+    def close(self):
+        self.workers.close()
+        self.workers.join()
+        self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,93 @@
+# coding: utf-8
+
+# =====================================
+# Recleaning of the tag values stored in the database
+# =====================================
+#
+# After adding entries to mapping_street or mapping_state (or changing
+# zipcode_ranges), reclean applies the cleaners of cleaning.py to the tag
+# values already in the database instead of re-running process_map and
+# rebuilding it:
+#
+#   python reclean.py boston_massachusetts.db
+#
+# Only the rows of the cleaned tags (addr:street, addr:state, addr:postcode)
+# are read, through the (key, value, id) indexes of queries.py: each distinct
+# value is cleaned once, and one UPDATE per value that the cleaning changes
+# rewrites its rows. tag_counts (tag_stats.py) is adjusted by the number of
+# rows rewritten. The values are those stored, already cleaned: corrections
+# made by the new mappings apply, but a value replaced by '0' stays '0'.
+
+import sqlite3
+import sys
+import time
+from collections import OrderedDict
+
+from cleaning import CLEANERS, clear_caches
+from tag_stats import TagStats, has_stats_tables
+
+# Tag tables and the element type of their rows
+TAG_TABLES = [('nodes_tags', 'node'), ('ways_tags', 'way'), ('relations_tags', 'relation')]
+
+
+def value_changes(con, table, k, cleaner):
+    """{value: cleaned value} of the distinct values of the tag k (e.g.
+    'addr:street') in a tags table which the cleaner changes"""
+    tag_type, key = k.split(':', 1)
+    changes = {}
+    for (value,) in con.execute('SELECT DISTINCT value FROM {0} WHERE key=? AND type=?;'
+                                .format(table), (key, tag_type)):
+        cleaned = cleaner(value)
+        if cleaned != value:
+            changes[value] = cleaned
+    return changes
+
+
+def reclean(con, cleaners=CLEANERS, tables=TAG_TABLES):
+    """Re-apply the cleaners ({tag: function}) to the tag values of the tables
+    in one transaction; returns the number of rows updated per tag"""
+    names = set(row[0] for row in con.execute(
+        "SELECT name FROM sqlite_master WHERE type='table';"))
+    stats = TagStats() if has_stats_tables(con) else None
+    updated = OrderedDict((k, 0) for k in sorted(cleaners))
+    try:
+        for table, element in tables:
+            if table not in names:
+                continue
+            for k in sorted(cleaners):
+                tag_type, key = k.split(':', 1)
+                for value, cleaned in value_changes(con, table, k, cleaners[k]).items():
+                    n = con.execute('UPDATE {0} SET value=? WHERE key=? AND value=? AND type=?;'
+                                    .format(table), (cleaned, key, value, tag_type)).rowcount
+                    updated[k] += n
+                    # the statistics cover nodes and ways; the cleaned keys
+                    # are not among the TAG_PAIRS
+                    if stats is not None and element != 'relation':
+                        stats.counts['tag_counts'][(element, key, value)] -= n
+                        stats.counts['tag_counts'][(element, key, cleaned)] += n
+        if stats is not None:
+            stats.flush(con)
+        con.commit()
+    except:
+        con.rollback()
+        raise
+    return updated
+
+
+def reclean_db(db_path, cleaners=CLEANERS):
+    """Reclean the database at db_path with the current mappings"""
+    clear_caches()
+    con = sqlite3.connect(db_path)
+    con.text_factory = str
+    try:
+        return reclean(con, cleaners)
+    finally:
+        con.close()
+
+
+if __name__ == '__main__':
+    started = time.time()
+    updated = reclean_db(sys.argv[1])
+    for k, n in updated.items():
+        print('{0}: {1} rows updated'.format(k, n))
+    print('{0:.2f} s'.format(time.time() - started))
@@ -0,0 +1,69 @@
+# coding: utf-8
+
+# =====================================
+# Relation lookups
+# =====================================
+#
+# Relations are loaded into the relations, relations_tags and
+# relations_members tables (one row per member, in order). The indexes of
+# queries.py answer both directions without reading the OSM file again:
+#
+#   members(con, 2315704)                   # [(member_type, member_id, role)]
+#   parent_relations(con, 'way', 28854123)  # ids of the relations of the way
+#   multipolygons(con)                      # {id: {'outer': [...], 'inner': [...]}}
+#   routes(con, 'bus')                      # [(id, route, ref, name)]
+
+from collections import OrderedDict
+
+
+def members(con, relation_id):
+    """(member_type, member_id, role) of the members of a relation, in order"""
+    return con.execute('''SELECT member_type, member_id, role FROM relations_members
+        WHERE id=? ORDER BY position;''', (relation_id,)).fetchall()
+
+
+def parent_relations(con, member_type, member_id):
+    """Ids of the relations having the element as a member"""
+    return [row[0] for row in con.execute('''SELECT DISTINCT id FROM relations_members
+        WHERE member_type=? AND member_id=? ORDER BY id;''', (member_type, member_id))]
+
+
+def relations_with_tag(con, key, value=None):
+    """Ids of the relations with a tag (of any value if value is None)"""
+    if value is None:
+        rows = con.execute('SELECT DISTINCT id FROM relations_tags WHERE key=? ORDER BY id;',
+                           (key,))
+    else:
+        rows = con.execute('''SELECT DISTINCT id FROM relations_tags
+            WHERE key=? AND value=? ORDER BY id;''', (key, value))
+    return [row[0] for row in rows]
+
+
+def multipolygons(con):
+    """Way members of the multipolygon relations by role: {relation id:
+    {'outer': [way ids], 'inner': [way ids]}} (an empty role counts as
+    outer)"""
+    polygons = OrderedDict()
+    for relation_id, role, way_id in con.execute('''SELECT m.id, m.role, m.member_id
+            FROM relations_tags t
+                JOIN relations_members m ON m.id=t.id
+            WHERE t.key='type' AND t.value='multipolygon' AND m.member_type='way'
+            ORDER BY m.id, m.position;'''):
+        rings = polygons.setdefault(relation_id, {'outer': [], 'inner': []})
+        rings['inner' if role == 'inner' else 'outer'].append(way_id)
+    return polygons
+
+
+def routes(con, route=None):
+    """(id, route, ref, name) of the route relations, optionally of one kind
+    of route ('bus', 'subway', 'bicycle', ...)"""
+    sql = '''SELECT r.id, r.value,
+            (SELECT value FROM relations_tags WHERE id=r.id AND key='ref'),
+            (SELECT value FROM relations_tags WHERE id=r.id AND key='name')
+        FROM relations_tags r
+        WHERE r.key='route' {0}
+            AND r.id IN (SELECT id FROM relations_tags WHERE key='type' AND value='route')
+        ORDER BY r.id;'''
+    if route is None:
+        return con.execute(sql.format('')).fetchall()
+    return con.execute(sql.format('AND r.value=?'), (route,)).fetchall()
@@ -0,0 +1,130 @@
+# coding: utf-8
+
+# =====================================
+# Spatial index and area queries over the nodes
+# =====================================
+#
+# The nodes are indexed in an SQLite R*Tree virtual table (nodes_rtree),
+# built when the database is loaded (load_db.py) and kept up to date by
+# osc_update.py. bbox_query, radius_query and polygon_query read the
+# candidate nodes from the index and can be combined with tag filters:
+#
+#   radius_query(con, 42.3601, -71.0589, 500, tags={'amenity': 'restaurant'})
+#   polygon_query(con, [(42.35, -71.07), (42.37, -71.05), (42.34, -71.04)],
+#                 tags={'amenity': 'restaurant', 'cuisine': 'pizza'})
+#
+# The R*Tree stores 32-bit floats rounded outwards, so the exact lat/lon of
+# the nodes table are checked again on the candidates.
+
+import math
+
+RTREE_TABLE = 'nodes_rtree'
+
+SPATIAL_INDEX_SQL = [
+    'DROP TABLE IF EXISTS {0};'.format(RTREE_TABLE),
+    'CREATE VIRTUAL TABLE {0} USING rtree(id, min_lat, max_lat, min_lon, max_lon);'.format(
+        RTREE_TABLE),
+    '''INSERT INTO {0}
+    SELECT id, lat, lat, lon, lon FROM nodes WHERE lat IS NOT NULL AND lon IS NOT NULL;'''.format(
+        RTREE_TABLE),
+]
+
+# Mean radius of the earth in meters
+EARTH_RADIUS = 6371008.8
+
+
+def create_spatial_index(con):
+    """(Re)build the R*Tree of the nodes"""
+    for statement in SPATIAL_INDEX_SQL:
+        con.execute(statement)
+    con.commit()
+
+
+def has_spatial_index(con):
+    return con.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?;",
+                       (RTREE_TABLE,)).fetchone() is not None
+
+
+def _tag_filters(tags):
+    """SQL conditions and parameters requiring the node n to have the given
+    tags ({key: value}, value None for any value)"""
+    conditions = []
+    params = []
+    for key, value in sorted(tags.items()):
+        if value is None:
+            conditions.append('EXISTS (SELECT 1 FROM nodes_tags t WHERE t.id = n.id '
+                              'AND t.key = ?)')
+            params.append(key)
+        else:
+            conditions.append('EXISTS (SELECT 1 FROM nodes_tags t WHERE t.id = n.id '
+                              'AND t.key = ? AND t.value = ?)')
+            params.extend((key, value))
+    return conditions, params
+
+
+def bbox_query(con, min_lat, min_lon, max_lat, max_lon, tags=None, use_index=True):
+    """(id, lat, lon) of the nodes inside a bounding box having the tags
+
+    use_index=False scans the nodes table instead of the R*Tree.
+    """
+    bounds = [min_lat, max_lat, min_lon, max_lon]
+    if use_index:
+        sql = ['SELECT n.id, n.lat, n.lon FROM {0} r JOIN nodes n ON n.id = r.id'.format(
+            RTREE_TABLE),
+               'WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?',
+               'AND n.lat BETWEEN ? AND ? AND n.lon BETWEEN ? AND ?']
+        params = bounds + bounds
+    else:
+        sql = ['SELECT n.id, n.lat, n.lon FROM nodes n',
+               'WHERE n.lat BETWEEN ? AND ? AND n.lon BETWEEN ? AND ?']
+        params = bounds
+    conditions, tag_params = _tag_filters(tags or {})
+    sql.extend('AND ' + condition for condition in conditions)
+    return con.execute('\n'.join(sql) + ';', params + tag_params).fetchall()
+
+
+def distance(lat1, lon1, lat2, lon2):
+    """Great-circle (haversine) distance in meters"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2 +
+         math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def radius_query(con, lat, lon, radius, tags=None, use_index=True):
+    """(id, lat, lon, distance) of the nodes within radius meters of a point
+    having the tags, nearest first"""
+    dlat = math.degrees(float(radius) / EARTH_RADIUS)
+    dlon = dlat / max(math.cos(math.radians(lat)), 1e-12)
+    rows = bbox_query(con, lat - dlat, lon - dlon, lat + dlat, lon + dlon, tags, use_index)
+    found = []
+    for node_id, node_lat, node_lon in rows:
+        d = distance(lat, lon, node_lat, node_lon)
+        if d <= radius:
+            found.append((node_id, node_lat, node_lon, d))
+    found.sort(key=lambda row: row[3])
+    return found
+
+
+def point_in_polygon(lat, lon, polygon):
+    """Even-odd rule test of a point against a ring of (lat, lon) vertices"""
+    inside = False
+    j = len(polygon) - 1
+    for i in range(len(polygon)):
+        lat_i, lon_i = polygon[i]
+        lat_j, lon_j = polygon[j]
+        if (lat_i > lat) != (lat_j > lat):
+            if lon < (lon_j - lon_i) * (lat - lat_i) / (lat_j - lat_i) + lon_i:
+                inside = not inside
+        j = i
+    return inside
+
+
+def polygon_query(con, polygon, tags=None, use_index=True):
+    """(id, lat, lon) of the nodes inside a polygon (a ring of (lat, lon)
+    vertices) having the tags"""
+    lats = [p[0] for p in polygon]
+    lons = [p[1] for p in polygon]
+    rows = bbox_query(con, min(lats), min(lons), max(lats), max(lons), tags, use_index)
+    return [row for row in rows if point_in_polygon(row[1], row[2], polygon)]
@@ -0,0 +1,232 @@
+# coding: utf-8
+
+# =====================================
+# Content-addressed cache of the pipeline stages
+# =====================================
+#
+# Each stage (audit, CSV generation, database load) is run through
+# StageCache.run with a key made of the digests of everything it reads: the
+# input files and the configuration it depends on. The stage is skipped when
+# the key matches the one of its last run and its outputs are unchanged:
+#
+#   cache = StageCache()
+#   osm = cache.file_digest(OSM_FILE)
+#   reports = cache.run('audit', [osm, audit_config()], lambda: audit(OSM_FILE))
+#   cache.run('csv', [osm, cleaning_config(), shaping_config()],
+#             lambda: process_map(OSM_FILE, validate=True), outputs=CSV_PATHS)
+#   cache.run('db', [cache.file_digest(p) for p in CSV_PATHS] + [db_config()],
+#             build_db, outputs=[DB_PATH])
+#
+# The database key is made of the digests of the CSV files and of the loading
+# code, so a change of the cleaning mappings reruns the CSV generation and,
+# only if the CSV files actually changed, the database load; the audit is not
+# affected.
+#
+# The configuration digests include the source of the modules doing the
+# work (any edit of their code reruns the stage) besides the values which
+# may be changed at run time, such as the mappings of cleaning.py.
+
+import cPickle as pickle
+import hashlib
+import json
+import os
+import types
+
+# Default directory of the manifest and of the pickled stage results
+CACHE_DIR = '.stage_cache'
+MANIFEST_NAME = 'manifest.json'
+
+# Size of the blocks read when hashing a file
+BLOCK_SIZE = 1 << 20
+
+
+def _source_digest(module):
+    """Digest of the source file of a module (of its compiled file if the
+    source is not available)"""
+    path = module.__file__
+    if path.endswith(('.pyc', '.pyo')) and os.path.exists(path[:-1]):
+        path = path[:-1]
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _canonical(obj):
+    """A repr of obj that does not depend on dict order or on the memory
+    addresses of functions (which are described by their code) or modules
+    (described by the digest of their source)"""
+    if isinstance(obj, dict):
+        return '{' + ', '.join(sorted(_canonical(k) + ': ' + _canonical(v)
+                                      for k, v in obj.items())) + '}'
+    if isinstance(obj, (list, tuple)):
+        return '[' + ', '.join(_canonical(v) for v in obj) + ']'
+    if isinstance(obj, (set, frozenset)):
+        return '{' + ', '.join(sorted(_canonical(v) for v in obj)) + '}'
+    if isinstance(obj, types.FunctionType):
+        obj = obj.__code__
+    if isinstance(obj, types.CodeType):
+        return 'code(' + ', '.join([repr(obj.co_code), _canonical(obj.co_consts),
+                                    _canonical(obj.co_names)]) + ')'
+    if isinstance(obj, types.ModuleType):
+        return 'module(' + obj.__name__ + ', ' + _source_digest(obj) + ')'
+    if isinstance(obj, (types.BuiltinFunctionType, type)):
+        return obj.__name__
+    if hasattr(obj, 'pattern'):
+        # compiled regular expression
+        return 're(' + repr(obj.pattern) + ', ' + repr(obj.flags) + ')'
+    return repr(obj)
+
+
+def config_digest(*objects):
+    """Digest of configuration objects (mappings, lists, schemas, functions,
+    modules)"""
+    return hashlib.sha1('\n'.join(_canonical(obj) for obj in objects)).hexdigest()
+
+
+def audit_config():
+    """Digest of what the audit reports depend on besides the OSM file"""
+    import audit
+    import osm_stream
+    import street_types
+    return config_digest(audit, osm_stream, street_types, audit.expected, list(audit.AUDITORS))
+
+
+def cleaning_config():
+    """Digest of the cleaning mappings and functions of cleaning.py"""
+    import cleaning
+    import street_types
+    import zipcodes
+    return config_digest(cleaning, street_types, zipcodes,
+                         cleaning.mapping_street, cleaning.mapping_state,
+                         cleaning.zipcode_ranges, sorted(cleaning.CLEANERS),
+                         cleaning.street_normalizer.table)
+
+
+def shaping_config():
+    """Digest of the schema and of the code shaping, validating and writing
+    the CSV rows"""
+    import csv_output
+    import fast_validator
+    import osm_shards
+    import osm_stream
+    import pbf_reader
+    import process_osm
+    import schema
+    return config_digest(process_osm, csv_output, fast_validator, osm_stream, osm_shards,
+                         pbf_reader, schema,
+                         schema.schema, process_osm.LOWER_COLON, process_osm.PROBLEMCHARS,
+                         process_osm.NODE_FIELDS, process_osm.NODE_TAGS_FIELDS,
+                         process_osm.WAY_FIELDS, process_osm.WAY_NODES_FIELDS,
+                         process_osm.WAY_TAGS_FIELDS, process_osm.RELATION_FIELDS,
+                         process_osm.RELATION_MEMBERS_FIELDS, process_osm.RELATION_TAGS_FIELDS)
+
+
+def db_config():
+    """Digest of the tables, settings, indexes and statistics of the
+    database and of the code loading it"""
+    import load_db
+    import queries
+    import schema
+    import spatial
+    import tag_stats
+    return config_digest(load_db, tag_stats, queries, spatial, schema,
+                         load_db.TABLES, load_db.LOAD_PRAGMAS, load_db.DEFAULT_PRAGMAS,
+                         load_db.POST_LOAD_SQL, tag_stats.STATS_TABLES)
+
+
+def stage_key(parts):
+    return hashlib.sha1('\n'.join(str(part) for part in parts)).hexdigest()
+
+
+class StageCache(object):
+    """Manifest of the last run of each stage, kept in cache_dir"""
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.manifest_path = os.path.join(cache_dir, MANIFEST_NAME)
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {'stages': {}, 'files': {}}
+
+    def save(self):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+        os.rename(tmp_path, self.manifest_path)
+
+    def file_digest(self, path):
+        """SHA-1 of a file's content; only rehashed when its size or
+        modification time changed since it was last hashed"""
+        st = os.stat(path)
+        stamp = [st.st_size, st.st_mtime]
+        known = self.manifest['files'].get(path)
+        if known is not None and known[:2] == stamp:
+            return known[2]
+        sha = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(BLOCK_SIZE), ''):
+                sha.update(block)
+        digest = sha.hexdigest()
+        self.manifest['files'][path] = stamp + [digest]
+        return digest
+
+    def _result_path(self, name, key):
+        return os.path.join(self.cache_dir, '{0}-{1}.pickle'.format(name, key))
+
+    def is_fresh(self, name, key):
+        """True if the stage last ran with this key and left its outputs
+        (or its pickled result) unchanged"""
+        entry = self.manifest['stages'].get(name)
+        if entry is None or entry['key'] != key:
+            return False
+        if entry['outputs'] is None:
+            return os.path.exists(self._result_path(name, key))
+        for path, digest in entry['outputs']:
+            if not os.path.exists(path) or self.file_digest(path) != digest:
+                return False
+        return True
+
+    def run(self, name, parts, func, outputs=None):
+        """Run func unless the stage is fresh for the key made of parts
+
+        Without outputs, the return value of func is the result of the stage
+        and is pickled in the cache directory; with outputs (the paths of the
+        files written by func) nothing is returned.
+        """
+        key = stage_key(parts)
+        if self.is_fresh(name, key):
+            print 'stage {0}: unchanged, skipped'.format(name)
+            if outputs is None:
+                with open(self._result_path(name, key), 'rb') as f:
+                    return pickle.load(f)
+            return None
+
+        self.invalidate(name)
+        result = func()
+        entry = {'key': key, 'outputs': None}
+        if outputs is None:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            with open(self._result_path(name, key), 'wb') as f:
+                pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+        else:
+            entry['outputs'] = [[path, self.file_digest(path)] for path in outputs]
+            result = None
+        self.manifest['stages'][name] = entry
+        self.save()
+        return result
+
+    def invalidate(self, name):
+        """Forget the last run of a stage (e.g. after editing its outputs)"""
+        entry = self.manifest['stages'].pop(name, None)
+        if entry is not None:
+            if entry['outputs'] is None:
+                path = self._result_path(name, entry['key'])
+                if os.path.exists(path):
+                    os.remove(path)
+            self.save()
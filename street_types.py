@@ -0,0 +1,193 @@
+# coding: utf-8
+
+# =====================================
+# Street type normalization
+# =====================================
+#
+# StreetTypeNormalizer finds the street type of an addr:street value with one
+# scan of its tokens from the end, skipping what may follow the type: unit
+# numbers ("#3", "Suite 2", "Apt 4B", a bare number) and directions ("N",
+# "West"). The audit (street_type) and the cleaning (normalize) find the type
+# token the same way (_type_index). It is looked up, without case and
+# trailing punctuation, in a table compiled once from the expected types, the
+# mapping_street corrections and the usual abbreviations, and only that token
+# is replaced:
+#
+#   "Massachusetts Ave #3"  -> "Massachusetts Avenue #3"
+#   "Main St, Suite 2"      -> "Main Street, Suite 2"
+#   "Main St N"             -> "Main Street N"
+#   "Harvard st."           -> "Harvard Street"
+#   "St"                    -> "Street"
+#
+# Names whose type is unknown are left unchanged. candidates() proposes
+# corrections for the unknown types of an audit report, most frequent first,
+# from a trie of the expected types (prefixes such as "Aven" and
+# abbreviations such as "Blvd" or "Tpk" spelled as a subsequence of the type).
+
+import re
+
+# Tokens of a name: "#3" is a token of its own even without a space before it
+TOKEN_RE = re.compile(r'#?[^\s#]+')
+
+# Unit designators and numbers which may follow the street type
+UNIT_WORDS = set(['suite', 'ste', 'unit', 'apt', 'apartment', 'fl', 'floor', 'rm', 'room',
+                  'bldg', 'building', 'no', '#'])
+UNIT_NUMBER_RE = re.compile(r'^#\S*$|^\d+[a-z]?$')
+
+DIRECTIONS = set(['n', 's', 'e', 'w', 'ne', 'nw', 'se', 'sw',
+                  'north', 'south', 'east', 'west'])
+
+# Usual abbreviations of the expected street types (USPS suffixes)
+STREET_ABBREVIATIONS = {
+    'av': 'Avenue', 'ave': 'Avenue', 'aven': 'Avenue', 'avn': 'Avenue',
+    'blvd': 'Boulevard', 'boul': 'Boulevard', 'blv': 'Boulevard',
+    'cir': 'Circle', 'circ': 'Circle', 'cmns': 'Commons', 'ctr': 'Center', 'cntr': 'Center',
+    'ct': 'Court', 'crt': 'Court', 'dr': 'Drive', 'drv': 'Drive',
+    'hwy': 'Highway', 'hway': 'Highway', 'ln': 'Lane',
+    'pkwy': 'Parkway', 'pky': 'Parkway', 'pkway': 'Parkway', 'pl': 'Place',
+    'rd': 'Road', 'sq': 'Square', 'st': 'Street', 'str': 'Street', 'strt': 'Street',
+    'tpke': 'Turnpike', 'tpk': 'Turnpike', 'trl': 'Trail', 'wy': 'Way',
+}
+
+
+def _key(token):
+    """Lookup key of a token: lower case, without trailing punctuation"""
+    return token.rstrip('.,;:').lower()
+
+
+def _is_unit(key):
+    return key in UNIT_WORDS or UNIT_NUMBER_RE.match(key) is not None
+
+
+def _type_index(keys):
+    """Index of the street type among the lookup keys of the tokens of a
+    name: the last one which is not a unit designator, unit number or
+    direction, or the first one if all those after it are; None if there is
+    none"""
+    for i in range(len(keys) - 1, 0, -1):
+        if not (_is_unit(keys[i]) or keys[i] in DIRECTIONS):
+            return i
+    if keys and not _is_unit(keys[0]):
+        return 0
+    return None
+
+
+def street_type(name):
+    """The street type of a name as written: its last token before the unit
+    designators, numbers and directions (e.g. "Ave" of "Massachusetts Ave
+    #3", "St" of "Main St, Suite 2" and of "Main St N"), or None"""
+    tokens = TOKEN_RE.findall(name)
+    i = _type_index([_key(token) for token in tokens])
+    if i is None:
+        return None
+    return tokens[i] if i == len(tokens) - 1 else tokens[i].rstrip(',;:')
+
+
+class StreetTypeNormalizer(object):
+    """Replaces abbreviated or misspelled street types by the expected ones
+
+    `types` are the expected street types and `mapping` the corrections of
+    cleaning.mapping_street, which take precedence over the built-in
+    abbreviations. build() must be called again after changing them.
+    """
+
+    def __init__(self, types, mapping, abbreviations=STREET_ABBREVIATIONS):
+        self.types = types
+        self.mapping = mapping
+        self.abbreviations = abbreviations
+        self.build()
+
+    def build(self):
+        table = {}
+        for key, street_type in self.abbreviations.items():
+            table[key] = street_type
+        for street_type in self.types:
+            table[_key(street_type)] = street_type
+        for key, street_type in self.mapping.items():
+            table[_key(key)] = street_type
+        self.table = table
+
+        # trie of the expected types, for the candidates of unknown types
+        self.trie = {}
+        for street_type in self.types:
+            node = self.trie
+            for char in street_type.lower():
+                node = node.setdefault(char, {})
+            node[None] = street_type
+
+    def normalize(self, name):
+        """The name with its street type replaced by the expected one"""
+        tokens = list(TOKEN_RE.finditer(name))
+        i = _type_index([_key(token.group()) for token in tokens])
+        if i is None:
+            return name
+        token = tokens[i].group()
+        street_type = self.table.get(_key(token))
+        if street_type is None:
+            return name
+        start, end = tokens[i].span()
+        if i < len(tokens) - 1:
+            # keep the separator before the unit ("St, Suite 2")
+            street_type += token[len(token.rstrip('.,;:')):].replace('.', '')
+        if street_type == token:
+            return name
+        return name[:start] + street_type + name[end:]
+
+    def __call__(self, name):
+        return self.normalize(name)
+
+    def guesses(self, token):
+        """Expected types which the token abbreviates: first those it is a
+        prefix of, then those spelling it as a subsequence (same first
+        letter)"""
+        key = _key(token)
+        if not key:
+            return []
+        prefix, subsequence = [], []
+
+        def walk(node, j, is_prefix):
+            if j == len(key):
+                for street_type in _leaves(node):
+                    (prefix if is_prefix else subsequence).append(street_type)
+                return
+            for char, child in node.items():
+                if char is None:
+                    continue
+                if char == key[j]:
+                    walk(child, j + 1, is_prefix)
+                elif j > 0:
+                    walk(child, j, False)
+
+        walk(self.trie, 0, True)
+        ranked = []
+        order = self.types.index
+        for street_type in sorted(prefix, key=order) + sorted(subsequence, key=order):
+            if street_type not in ranked:
+                ranked.append(street_type)
+        return ranked
+
+    def candidates(self, street_types, limit=3):
+        """Corrections proposed for the unexpected types of an audit report
+        ({type: set of names} or {type: count}): a list of (type, count,
+        [expected types]) sorted by decreasing count, the known correction
+        first if the type is in the table"""
+        proposals = []
+        for token, names in street_types.items():
+            count = names if isinstance(names, (int, long)) else len(names)
+            known = self.table.get(_key(token))
+            guesses = [known] if known is not None else self.guesses(token)[:limit]
+            proposals.append((token, count, guesses))
+        proposals.sort(key=lambda proposal: (-proposal[1], proposal[0]))
+        return proposals
+
+
+def _leaves(node):
+    """Street types stored under a trie node"""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        for char, child in node.items():
+            if char is None:
+                yield child
+            else:
+                stack.append(child)
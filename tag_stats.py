@@ -0,0 +1,176 @@
+# coding: utf-8
+
+# =====================================
+# Precomputed tag and user statistics
+# =====================================
+#
+# Aggregate tables kept next to the OSM tables so that the dashboard queries
+# (top postcodes, cities, amenities, cuisines, religion, buildings, users)
+# read a few small rows instead of grouping the whole tag tables:
+#
+#   tag_counts       number of tags per element type, key and value
+#   key_counts       number of tags per element type and key
+#   user_counts      number of nodes and ways per user
+#   tag_pair_counts  values of `key` on the elements having a tag whose value
+#                    is `filter_value` (e.g. cuisines of restaurants), for the
+#                    pairs listed in TAG_PAIRS
+#
+# The primary keys lead with the tag key, so that STAT_QUERIES search the
+# tables by key; the cities query (keys LIKE '%city') finds its keys in the
+# small key_counts table before searching tag_counts.
+#
+# TagStats accumulates the counts of the shaped elements while they are
+# loaded and adds them to the tables on every flush, so appending data (or
+# removing it, with sign=-1) updates the statistics incrementally. Like the
+# queries they answer, the statistics only cover nodes and ways.
+
+from collections import Counter, OrderedDict
+
+# (filter_value, key) pairs counted in tag_pair_counts
+TAG_PAIRS = [('place_of_worship', 'religion'), ('restaurant', 'cuisine')]
+
+STATS_TABLES = [
+    ('tag_counts', '''CREATE TABLE tag_counts (
+    element TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (key, element, value));'''),
+    ('key_counts', '''CREATE TABLE key_counts (
+    element TEXT NOT NULL,
+    key TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (key, element));'''),
+    ('user_counts', '''CREATE TABLE user_counts (
+    user TEXT NOT NULL,
+    uid INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (user, uid));'''),
+    ('tag_pair_counts', '''CREATE TABLE tag_pair_counts (
+    element TEXT NOT NULL,
+    filter_value TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (key, filter_value, element, value));'''),
+]
+
+# Upsert statements of each table: (insert of a zero row, increment)
+UPSERTS = {
+    'tag_counts': ('INSERT OR IGNORE INTO tag_counts VALUES (?,?,?,0);',
+                   'UPDATE tag_counts SET count = count + ? '
+                   'WHERE element=? AND key=? AND value=?;'),
+    'key_counts': ('INSERT OR IGNORE INTO key_counts VALUES (?,?,0);',
+                   'UPDATE key_counts SET count = count + ? WHERE element=? AND key=?;'),
+    'user_counts': ('INSERT OR IGNORE INTO user_counts VALUES (?,?,0);',
+                    'UPDATE user_counts SET count = count + ? WHERE user=? AND uid=?;'),
+    'tag_pair_counts': ('INSERT OR IGNORE INTO tag_pair_counts VALUES (?,?,?,?,0);',
+                        'UPDATE tag_pair_counts SET count = count + ? '
+                        'WHERE element=? AND filter_value=? AND key=? AND value=?;'),
+}
+
+# The dashboard queries of queries.py answered from the statistics tables
+STAT_QUERIES = OrderedDict([
+    ('postcodes', '''SELECT value, SUM(count) as count FROM tag_counts
+WHERE key='postcode' GROUP BY value ORDER BY count DESC LIMIT 10;'''),
+    ('cities', '''SELECT value, SUM(count) as count FROM tag_counts
+WHERE key IN (SELECT key FROM key_counts WHERE key LIKE '%city')
+GROUP BY value ORDER BY count DESC LIMIT 10;'''),
+    ('unique_users', '''SELECT COUNT(DISTINCT(uid)) FROM user_counts;'''),
+    ('top_users', '''SELECT user, SUM(count) as num FROM user_counts
+GROUP BY user ORDER BY num DESC LIMIT 10;'''),
+    ('single_post_users', '''SELECT COUNT(*) FROM
+    (SELECT user, SUM(count) as num FROM user_counts GROUP BY user HAVING num=1) u;'''),
+    ('amenities', '''SELECT value, count as num FROM tag_counts
+WHERE element='node' AND key='amenity' ORDER BY num DESC LIMIT 10;'''),
+    ('religion', '''SELECT value, count as num FROM tag_pair_counts
+WHERE element='node' AND filter_value='place_of_worship' AND key='religion'
+ORDER BY num DESC LIMIT 1;'''),
+    ('cuisines', '''SELECT value, count as num FROM tag_pair_counts
+WHERE element='node' AND filter_value='restaurant' AND key='cuisine'
+ORDER BY num DESC LIMIT 10;'''),
+    ('buildings', '''SELECT value, count as num FROM tag_counts
+WHERE element='node' AND key='building' ORDER BY num DESC;'''),
+])
+
+
+def create_stats_tables(con):
+    """Create empty statistics tables (dropping existing ones)"""
+    for table, create in STATS_TABLES:
+        con.execute('DROP TABLE IF EXISTS {0};'.format(table))
+        con.execute(create)
+    con.commit()
+
+
+def has_stats_tables(con):
+    names = set(row[0] for row in con.execute(
+        "SELECT name FROM sqlite_master WHERE type='table';"))
+    return all(table in names for table, _ in STATS_TABLES)
+
+
+def rebuild_stats(con):
+    """Recompute all the statistics from the nodes/ways tables"""
+    create_stats_tables(con)
+    for element, table in (('node', 'nodes_tags'), ('way', 'ways_tags')):
+        con.execute('''INSERT INTO tag_counts
+            SELECT ?, key, value, COUNT(*) FROM {0}
+            WHERE key IS NOT NULL AND value IS NOT NULL
+            GROUP BY key, value;'''.format(table), (element,))
+        for filter_value, key in TAG_PAIRS:
+            con.execute('''INSERT INTO tag_pair_counts
+                SELECT ?, ?, t.key, t.value, COUNT(*) FROM {0} t
+                    JOIN (SELECT DISTINCT(id) FROM {0} WHERE value=?) i
+                    ON t.id=i.id
+                WHERE t.key=?
+                GROUP BY t.value;'''.format(table), (element, filter_value, filter_value, key))
+    con.execute('''INSERT INTO key_counts
+        SELECT element, key, SUM(count) FROM tag_counts GROUP BY element, key;''')
+    con.execute('''INSERT INTO user_counts
+        SELECT user, uid, COUNT(*) FROM
+            (SELECT user, uid FROM nodes UNION ALL SELECT user, uid FROM ways)
+        GROUP BY user, uid;''')
+    con.commit()
+
+
+class TagStats(object):
+    """Accumulates the statistics of shaped elements until flushed"""
+
+    def __init__(self):
+        self.counts = dict((table, Counter()) for table, _ in STATS_TABLES)
+
+    def add(self, record, sign=1):
+        """Count a shaped element (process_osm.ShapedElement), sign=-1 to
+        discount a removed one; relations are not counted"""
+        element = record.tag
+        if element == 'relation':
+            return
+        tags = record.tags
+        self.counts['user_counts'][(record.get('user'), int(record.get('uid')))] += sign
+
+        # tag rows are (id, key, value, type)
+        tag_counts = self.counts['tag_counts']
+        key_counts = self.counts['key_counts']
+        for tag in tags:
+            tag_counts[(element, tag[1], tag[2])] += sign
+            key_counts[(element, tag[1])] += sign
+
+        values = set(tag[2] for tag in tags)
+        pair_counts = self.counts['tag_pair_counts']
+        for filter_value, key in TAG_PAIRS:
+            if filter_value in values:
+                for tag in tags:
+                    if tag[1] == key:
+                        pair_counts[(element, filter_value, key, tag[2])] += sign
+
+    def flush(self, con):
+        """Add the accumulated counts to the statistics tables (within the
+        caller's transaction) and reset them"""
+        for table, counts in self.counts.items():
+            if not counts:
+                continue
+            insert, update = UPSERTS[table]
+            con.executemany(insert, counts.keys())
+            con.executemany(update, ((n,) + key for key, n in counts.items()))
+            if any(n < 0 for n in counts.values()):
+                con.execute('DELETE FROM {0} WHERE count <= 0;'.format(table))
+            counts.clear()
@@ -0,0 +1,116 @@
+# coding: utf-8
+
+# =====================================
+# Zipcode validation by region
+# =====================================
+#
+# A region is a list of ZIP specs: a zipcode ("02134"), a 3-digit prefix
+# ("021"), or a range of either ("01432-02769", "010-027"). ZipcodeTable
+# compiles them once into a flag per 5-digit zipcode, so checking a value is
+# an index into a 100,000 byte table whatever the number of ranges:
+#
+#   table = ZipcodeTable(REGIONS['massachusetts'])
+#   table.clean('02134-1234')                 # '02134'
+#   table.clean('021341234', plus4=True)      # '02134-1234'
+#   table.clean('10001')                      # '0' (outside the region)
+#
+# clean_column cleans a whole column of values (e.g. the postcodes of the
+# nodes_tags and ways_tags tables), parsing each distinct value once; a NumPy
+# array gives back a NumPy array.
+
+import re
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Regions of valid zipcodes
+REGIONS = {
+    'boston': ['01432-02769'],
+    'massachusetts': ['010-027', '055'],
+}
+
+# First run of digits of a value, and the +4 extension after a 5-digit zipcode
+DIGITS_RE = re.compile(r'\d+')
+PLUS4_RE = re.compile(r'[- ](\d{4})(?!\d)')
+
+INVALID = '0'
+
+
+def zip_range(spec):
+    """First and last 5-digit zipcodes (as integers) of a ZIP spec"""
+    low, _, high = spec.strip().partition('-')
+    high = high or low
+    if not (low.isdigit() and high.isdigit() and len(low) == len(high) and
+            len(low) in (3, 5) and low <= high):
+        raise ValueError("invalid ZIP range {0!r}".format(spec))
+    scale = 10 ** (5 - len(low))
+    return int(low) * scale, (int(high) + 1) * scale - 1
+
+
+class ZipcodeTable(object):
+    """Validates and normalizes zipcodes against the ZIP specs of a region"""
+
+    def __init__(self, specs):
+        self.specs = specs
+        self.build()
+
+    def build(self):
+        valid = bytearray(100000)
+        for spec in self.specs:
+            low, high = zip_range(spec)
+            valid[low:high + 1] = b'\x01' * (high - low + 1)
+        self.valid = valid
+
+    def __contains__(self, zipcode):
+        return len(zipcode) == 5 and zipcode.isdigit() and self.valid[int(zipcode)] == 1
+
+    def clean(self, value, plus4=False):
+        """The 5-digit zipcode of a value ("02134", "02134-1234", "021341234",
+        "MA 02134"), with its +4 extension if plus4, or '0' if there is none
+        or it is outside of the region"""
+        match = DIGITS_RE.search(value)
+        if match is None:
+            return INVALID
+        digits = match.group()
+        if len(digits) == 5:
+            zipcode = digits
+            extension = PLUS4_RE.match(value, match.end()) if plus4 else None
+            extension = extension.group(1) if extension is not None else None
+        elif len(digits) == 9:
+            zipcode, extension = digits[:5], digits[5:]
+        else:
+            return INVALID
+        if not self.valid[int(zipcode)]:
+            return INVALID
+        if plus4 and extension is not None:
+            return zipcode + '-' + extension
+        return zipcode
+
+    def __call__(self, value):
+        return self.clean(value)
+
+    def clean_column(self, values, plus4=False):
+        """The cleaned zipcodes of a column of values, each distinct value
+        being cleaned once: a list, or a NumPy array for a NumPy array"""
+        if numpy is not None and isinstance(values, numpy.ndarray):
+            distinct, inverse = numpy.unique(values, return_inverse=True)
+            cleaned = numpy.array([self.clean(value, plus4) for value in distinct],
+                                  dtype=object)
+            return cleaned[inverse]
+        cleaned = {}
+        column = []
+        for value in values:
+            zipcode = cleaned.get(value)
+            if zipcode is None:
+                zipcode = cleaned[value] = self.clean(value, plus4)
+            column.append(zipcode)
+        return column
+
+    def changes(self, values, plus4=False):
+        """{value: cleaned value} of the distinct values which cleaning changes"""
+        distinct = set(values)
+        return dict((value, zipcode) for value, zipcode
+                    in zip(distinct, self.clean_column(list(distinct), plus4))
+                    if zipcode != value)